@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from collections import OrderedDict
+
+from grasp import GraspBatch
+
+
+class AnnotationCache(object):
+    """
+    每张图片的标注以活动的 GraspRect 对象缓存，切换图片时直接取回，不再导出为 dict 再重新构建。
+    内存中的形状总数超过 max_shapes 时，最久未使用的图片按列存储（GraspBatch 的各列以及可见性）写入临时目录的 .npz 文件，
+    再次使用时读回，id 和可见性保持不变。
+    标注只在 exportTo() 时（即保存工程时）才序列化为 dict，且只处理上次导出后修改过的图片。
+    """
+
+    DEFAULT_MAX_SHAPES = 200000
+
+    def __init__(self, max_shapes=DEFAULT_MAX_SHAPES):
+        self.max_shapes = max_shapes
+        self._shapes = OrderedDict()  # file -> list of GraspRect, 最近使用的在最后
+        self._count = 0
+        self._spilled = dict()  # file -> npz path
+        self._spill_dir = None
+        self._modified = set()  # 上次导出之后修改过的图片
+
+    def __contains__(self, file):
+        return file in self._shapes or file in self._spilled
+
+    def __len__(self):
+        return len(self._shapes) + len(self._spilled)
+
+    def put(self, file: str, shapes: list, modified: bool):
+        """放回图片的形状，modified 表示取出之后是否修改过；只是浏览过的图片不会在 exportTo() 中重新导出"""
+        self._discard(file)
+        self._shapes[file] = shapes
+        self._count += len(shapes)
+        if modified:
+            self._modified.add(file)
+        self._evict()
+
+    def take(self, file: str):
+        """取出图片的形状（不在缓存中时返回 None），取出后由调用者持有，修改完成后再 put() 回来"""
+        if file in self._shapes:
+            shapes = self._shapes.pop(file)
+            self._count -= len(shapes)
+            return shapes
+        if file in self._spilled:
+            path = self._spilled.pop(file)
+            shapes = self._loadShapes(path)
+            os.remove(path)
+            return shapes
+        return None
+
+    def isModified(self, file: str):
+        """图片在上次导出之后是否修改过（包括修改后放回、现在又被取出的图片）"""
+        return file in self._modified
+
+    def remove(self, file: str):
+        self._discard(file)
+        self._modified.discard(file)
+
+    def clear(self):
+        self._shapes.clear()
+        self._count = 0
+        self._spilled.clear()
+        self._modified.clear()
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    def exportTo(self, results: dict):
+        """把上次导出后修改过的图片的标注写入 results["image_files"][file]["shapes"]，返回这些图片"""
+        exported = set()
+        for file in self._modified:
+            if file not in results["image_files"]:
+                continue
+            if file in self._shapes:
+                batch = GraspBatch.fromShapes(self._shapes[file])
+            elif file in self._spilled:
+                batch = self._loadBatch(self._spilled[file])
+            else:
+                continue
+            results["image_files"][file]["shapes"] = batch.export()
+            exported.add(file)
+        self._modified.clear()
+        return exported
+
+    def _discard(self, file: str):
+        shapes = self._shapes.pop(file, None)
+        if shapes is not None:
+            self._count -= len(shapes)
+        path = self._spilled.pop(file, None)
+        if path is not None:
+            os.remove(path)
+
+    def _evict(self):
+        # 至少保留最近放回的一张图片
+        while self._count > self.max_shapes and len(self._shapes) > 1:
+            file, shapes = self._shapes.popitem(last=False)
+            self._count -= len(shapes)
+            self._spilled[file] = self._saveShapes(shapes)
+
+    def _saveShapes(self, shapes: list):
+        batch = GraspBatch.fromShapes(shapes)
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="label_grasp_")
+        fd, path = tempfile.mkstemp(suffix=".npz", dir=self._spill_dir)
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, centers=batch.centers, sizes=batch.sizes, opens=batch.opens, angles=batch.angles,
+                     ids=np.array(batch.ids, dtype=str),
+                     visible=np.array([shape.visible() for shape in shapes], dtype=bool))
+        return path
+
+    @staticmethod
+    def _loadBatch(path: str) -> GraspBatch:
+        with np.load(path) as data:
+            return GraspBatch(data["centers"], data["sizes"], data["opens"], data["angles"], data["ids"].tolist())
+
+    @staticmethod
+    def _loadShapes(path: str) -> list:
+        with np.load(path) as data:
+            batch = GraspBatch(data["centers"], data["sizes"], data["opens"], data["angles"], data["ids"].tolist())
+            visible = data["visible"].tolist()
+        shapes = batch.toShapes()
+        for shape, is_visible in zip(shapes, visible):
+            if not is_visible:
+                shape.setVisible(False)
+        return shapes
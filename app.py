@@ -1,7 +1,5 @@
 import os
 import sys
-import glob
-import json
 import time
 
 from PyQt5.QtGui import *
@@ -14,6 +12,12 @@ from canvas import Canvas
 from label_list import LabelListWidget
 from file_list import FileListWidget
 from tool_bar import ToolBar
+from workers import DirScanner, ExistenceChecker, ProjectSaver
+from image_cache import ImageCache, ImagePrefetcher
+from annotation_cache import AnnotationCache
+from grasp import GraspBatch
+from project_io import SHARDED_SUFFIX, SQLITE_SUFFIXES, LazyImageFiles, RecoveryJournal, open_project, \
+    snapshot_results
 
 import utils
 import action
@@ -26,7 +30,15 @@ import action
 IMAGE_EXTENTIONS = ["jpg", "png"]
 
 
+def supported_image_extensions():
+    # QImageReader 的插件需要在 QApplication 创建之后才能查询，因此不在模块载入时计算
+    return sorted({fmt.data().decode("ascii").lower() for fmt in QImageReader.supportedImageFormats()})
+
+
 class MainWindow(QMainWindow):
+    PREFETCH_COUNT = 3  # 预取当前图片前后各几张
+    AUTOSAVE_INTERVAL = 30 * 1000  # ms
+
     def __init__(self):
         super(QWidget, self).__init__()
         self.setWindowTitle("My Label Tool")
@@ -34,23 +46,20 @@ class MainWindow(QMainWindow):
         self.canvas = Canvas(self)
         self.dirty = False  # set True indicates there exists unsaved changes
 
-        self.label_list = LabelListWidget()
+        self.label_list = LabelListWidget(self.canvas.store)
         self.shape_dock = QDockWidget(self.tr(u"Grasp list"), self)
         self.shape_dock.setObjectName(u"Grasp list")
         self.shape_dock.setWidget(self.label_list)
 
         # connection
         self.canvas.shapesAdded.connect(self.label_list.addShapes)
-        self.canvas.shapesRemoved.connect(self.label_list.removeShapes)
         self.canvas.shapesSelectionChanged.connect(self.label_list.changeShapesSelection)
         self.canvas.shapesAreaChanged.connect(self.label_list.updateShapesArea)
+        self.canvas.shapesEditFinished.connect(self.label_list.flushShapesArea)
 
         # self.label_list.shapesAdded.connect(self.canvas.addShapes)
         self.label_list.shapesRemoved.connect(self.canvas.removeShapes)
         self.label_list.shapesSelectionChanged.connect(self.canvas.changeShapesSelection)
-        self.label_list.shapeVisibleChanged.connect(self.canvas.changeShapesVisible)
-        self.label_list.shapesOrderChanged.connect(self.canvas.changeShapesOrder)
-        self.label_list.reconnectCanvasDataRequest.connect(self._reconnectCanvasAndLabel)
 
         self.file_list = FileListWidget()
         self.file_list.filesSelectionChanged.connect(
@@ -63,12 +72,14 @@ class MainWindow(QMainWindow):
         self.file_dock.setObjectName(u"File list")
         self.file_dock.setWidget(self.file_list)
 
-        # set dirty
-        self.canvas.shapesAdded.connect(self.setDirty)
-        self.canvas.shapesRemoved.connect(self.setDirty)
-        self.canvas.shapesAreaChanged.connect(self.setDirty)
-        self.label_list.shapesRemoved.connect(self.setDirty)
-        self.label_list.shapesOrderChanged.connect(self.setDirty)
+        # set dirty，切换图片时替换画布中的形状不算作修改（见 _replaceCanvasShapes）
+        self.shapes_modified = False  # 当前图片的形状在打开之后是否被修改过
+        self.replacing_shapes = False
+        self.canvas.shapesAdded.connect(self._shapesEdited)
+        self.canvas.shapesRemoved.connect(self._shapesEdited)
+        self.canvas.shapesAreaChanged.connect(self._shapesEdited)
+        self.canvas.shapesOrderChanged.connect(self._shapesEdited)
+        self.canvas.store.shapeVisibleChanged.connect(self._shapesEdited)
         self.file_list.fileLabeledChanged.connect(self.setDirty)
 
         # setup ui
@@ -89,6 +100,31 @@ class MainWindow(QMainWindow):
         self.image_files = None
         self.output_folder = None
         self.output_name = None
+        # 打开文件夹时扫描的图片扩展名（不区分大小写），以及是否扫描子文件夹
+        self.image_extensions = list(IMAGE_EXTENTIONS)
+        self.scan_recursive = False
+        self.dir_scanner = None
+        self.scan_opened_file = None  # 扫描过程中自动打开的图片，之后到达的批次中有排在它前面的文件时改为打开第一张
+        self.scan_recovered = set()  # 从恢复文件中重放、还没有被扫描到的图片
+        self.existence_checker = None
+        self.annotations = AnnotationCache()  # 各图片的形状（活动对象）
+        self.project = None  # JsonProject or SqliteProject, 当前保存路径对应的工程文件
+        # 换了保存路径之后的旧工程：写入新工程时仍可能从中读取未修改的形状，等到没有写入在进行时再关闭
+        self.retired_projects = []
+        # 只打开了图片目录、还没有工程文件路径时自动保存使用的恢复文件，第一次保存工程后删除
+        self.folder_recovery = None
+        self.project_suffix = ".json"  # 新工程的格式（扩展名）
+        self.float32_grasps = False  # JSON 和分片工程中的 grasp 参数是否保存为 float32
+        self.changed_files = set()  # 上次保存之后标注状态改变或被移除的图片
+        self.saver = ProjectSaver(self)  # 在后台线程中写入工程文件
+        self.saver.saveFinished.connect(self._projectSaved)
+        # 定时把上次保存之后的修改写入恢复文件（见 RecoveryJournal），写入同样在后台线程中进行
+        self.autosave_needed = False  # 上次自动保存之后是否有新的修改
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.autosave_timer.start(self.AUTOSAVE_INTERVAL)
+        self.image_cache = ImageCache()
+        self.prefetcher = ImagePrefetcher(self.image_cache, self)
         # image_file_name = os.path.join(image_folder, image_files[working_idx])
 
         self.results = {
@@ -215,6 +251,58 @@ class MainWindow(QMainWindow):
             "open-dir.png"
         )
 
+        scanRecursive = action.new_action(
+            self,
+            self.tr("Scan Subdirectories"),
+            lambda checked: setattr(self, "scan_recursive", checked)
+        )
+        scanRecursive.setCheckable(True)
+        scanRecursive.setChecked(self.scan_recursive)
+
+        allImageFormats = action.new_action(
+            self,
+            self.tr("All Supported Image Formats"),
+            lambda checked: setattr(self, "image_extensions",
+                                    supported_image_extensions() if checked else list(IMAGE_EXTENTIONS))
+        )
+        allImageFormats.setCheckable(True)
+
+        projectFormat = QMenu(self.tr("New Project Format"), self)
+        project_format_group = QActionGroup(self)
+        for name, suffix in ((self.tr("JSON"), ".json"),
+                             (self.tr("SQLite"), SQLITE_SUFFIXES[0]),
+                             (self.tr("Sharded (Index + Per-Image Files)"), SHARDED_SUFFIX)):
+            a = action.new_action(
+                self,
+                name,
+                lambda checked, suffix=suffix: setattr(self, "project_suffix", suffix)
+            )
+            a.setCheckable(True)
+            a.setChecked(suffix == self.project_suffix)
+            project_format_group.addAction(a)
+            projectFormat.addAction(a)
+
+        float32Grasps = action.new_action(
+            self,
+            self.tr("Store Grasps as Float32"),
+            lambda checked: setattr(self, "float32_grasps", checked)
+        )
+        float32Grasps.setCheckable(True)
+        float32Grasps.setChecked(self.float32_grasps)
+
+        frameRate = QMenu(self.tr("Frame Rate"), self)
+        frame_rate_group = QActionGroup(self)
+        for frame_rate in (30, 60, 120, 144):
+            a = action.new_action(
+                self,
+                self.tr("{} FPS").format(frame_rate),
+                lambda checked, fps=frame_rate: self.canvas.setFrameRate(fps)
+            )
+            a.setCheckable(True)
+            a.setChecked(frame_rate == self.canvas.frame_rate)
+            frame_rate_group.addAction(a)
+            frameRate.addAction(a)
+
         self.actions = utils.Struct(
             openPrevImg=openPrevImg,
             openNextImg=openNextImg
@@ -251,8 +339,13 @@ class MainWindow(QMainWindow):
                 openImages,
                 openDir,
                 None,
+                scanRecursive,
+                allImageFormats,
+                None,
                 saveProject,
-                changeOutputDir
+                changeOutputDir,
+                projectFormat,
+                float32Grasps
             ]
         )
 
@@ -270,13 +363,12 @@ class MainWindow(QMainWindow):
                 fitWindow,
                 # fitHeight,
                 # fitWidth,
-                fitOrigin
+                fitOrigin,
+                None,
+                frameRate
             ]
         )
 
-    def _reconnectCanvasAndLabel(self):
-        self.label_list.reconnectCanvasData(self.canvas.shapes)
-
     def _changeFilesSelection(self, selected, deselected):
         assert len(selected) <= 1, "Single selection mode"
         assert len(deselected) <= 1, "Single selection mode"
@@ -284,30 +376,73 @@ class MainWindow(QMainWindow):
         if len(deselected):
             # save current work
             print("[INFO] [from_app] Saving current work...")
+            # 形状以活动对象的形式保存在 annotations 中，保存工程时才序列化
             current_file = self.image_files[deselected[0]]
-            self.results["image_files"][current_file]["shapes"] = self.canvas.exportShapes()
+            shapes = self._replaceCanvasShapes(self.canvas.takeShapes)
+            modified = self.shapes_modified
+            if modified and self.project is not None and self.project.WRITE_ON_SWITCH and \
+                    not self.project.needsFullSave() and current_file in self.results["image_files"]:
+                # SQLite 工程切换图片时立即写入刚离开的、修改过的图片。
+                # 需要写完整的工程（第一次保存到这个路径，可能正在后台进行）时不写，修改留到下一次保存
+                self.results["image_files"][current_file]["shapes"] = GraspBatch.fromShapes(shapes).export()
+                self._writeProject({current_file})
+                self.changed_files.discard(current_file)
+                modified = False
+            self.annotations.put(current_file, shapes, modified)
 
         if len(selected):
             # load new file
             current_file = self.image_files[selected[0]]
             print("[INFO] [from_app] Loading data for image {}...".format(current_file))
-            if current_file not in self.results["image_files"]:
-                self.canvas.clear()
+            shapes = self.annotations.take(current_file)
+            if shapes is not None:
+                self._replaceCanvasShapes(self.canvas.setShapes, shapes)
+            elif current_file not in self.results["image_files"]:
+                self._replaceCanvasShapes(self.canvas.clear)
             else:
-                self.canvas.loadShapes(self.results["image_files"][current_file]["shapes"])
-
-            if self.image_folder is not None:  # relative path
-                self.canvas.loadImage(os.path.join(self.image_folder, current_file))
-            else:  # absolute path
-                self.canvas.loadImage(current_file)
+                self._replaceCanvasShapes(self.canvas.loadShapes, self.results["image_files"][current_file]["shapes"])
+
+            # 前后几张图片在后台预先解码，切换时通常可以直接从缓存中取出
+            # 按适应窗口所需的分辨率解码，放大时画布再按需解码图块
+            self.prefetcher.setDecodeSize(self.canvas.decodeSize())
+            path = self._imagePath(current_file)
+            self.canvas.setImage(self.prefetcher.load(path), path)
+            self._prefetchAround(selected[0])
+        # 重新打开修改后还没有导出的图片时保持修改状态，保存时从画布中导出
+        self.shapes_modified = len(selected) > 0 and self.annotations.isModified(self.image_files[selected[0]])
         self.setClean()
 
+    def _replaceCanvasShapes(self, replace, *args):
+        # 切换、关闭图片时替换画布中的形状，期间发出的 shapesAdded / shapesRemoved 不算作对标注的修改
+        self.replacing_shapes = True
+        try:
+            return replace(*args)
+        finally:
+            self.replacing_shapes = False
+
+    def _shapesEdited(self, *args):
+        if self.replacing_shapes:
+            return
+        self.shapes_modified = True
+        self.setDirty()
+
+    def _prefetchAround(self, index: int):
+        paths = []
+        for offset in range(1, self.PREFETCH_COUNT + 1):
+            # 先预取下一张，再预取上一张，与 A / D 键翻页的顺序一致
+            for i in (index + offset, index - offset):
+                if 0 <= i < len(self.image_files):
+                    paths.append(self._imagePath(self.image_files[i]))
+        self.prefetcher.prefetch(paths)
+
     def _changeFileLabeled(self, index: int, labeled: bool):
         file = self.image_files[index]
         self.results["image_files"][file]["labeled"] = labeled
+        self.changed_files.add(file)
 
     def setDirty(self):
         self.dirty = True
+        self.autosave_needed = True
 
     def setClean(self):
         self.dirty = False
@@ -337,7 +472,7 @@ class MainWindow(QMainWindow):
             self,
             self.tr("Open Project"),
             "./",
-            self.tr("Project File (*.json)")
+            self.tr("Project File (*.json {})".format(" ".join(["*" + suffix for suffix in SQLITE_SUFFIXES])))
         )[0]
         return path
 
@@ -347,7 +482,7 @@ class MainWindow(QMainWindow):
             self.tr("Open Images"),
             "./",
             self.tr("Image Files ({})"
-                    .format(" ".join(["*." + ext for ext in IMAGE_EXTENTIONS])))
+                    .format(" ".join(["*." + ext for ext in self.image_extensions])))
         )[0]
         return paths
 
@@ -371,11 +506,17 @@ class MainWindow(QMainWindow):
             return
 
         # clean the current content
+        self._stopBackgroundTasks()
         self.file_list.clear()
-        self.canvas.clear()
+        self._replaceCanvasShapes(self.canvas.clear)
+        self.annotations.clear()
 
-        with open(path, "r", encoding="utf-8") as j:
-            self.results = json.load(j)
+        # JSON 工程读取快照并重放追加写入的日志，SQLite 工程只读取文件名和 labeled
+        self._closeProject()
+        self.project = open_project(path)
+        self.results = self.project.load()
+        self.changed_files.clear()
+        recovered = self._replayRecovery(RecoveryJournal(path))
 
         self.image_folder = self.results["image_folder"].lower() \
             if self.results["image_folder"].lower() != "absolute_path" \
@@ -385,77 +526,24 @@ class MainWindow(QMainWindow):
         self.image_files.sort()
 
         # check if file exists
-        if self.image_folder is None:  # absolute path
-            found, not_found = [], []
-            for file in self.image_files:
-                if os.path.exists(file):
-                    found.append(file)
-                else:
-                    not_found.append(file)
-
-            self.image_files = found
-
-            if len(not_found):
-                box = QMessageBox(self)
-                box.setIcon(QMessageBox.Warning)
-                box.setText("{} file(s) cannot be found.".format(len(not_found)))
-                box.setInformativeText("Do you want the project to keep them?")
-                box.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-                box.setDefaultButton(QMessageBox.No)
-                box.setDetailedText(
-                    "The following file(s) cannot be found:\n\n" +
-                    "\n".join(["  - " + f for f in not_found])
-                )
-                ret = box.exec()
-                if ret == QMessageBox.No:
-                    for f in not_found:
-                        self.results["image_files"].pop(f)
-
-        else:  # relative path
-            if not os.path.exists(self.image_folder):
-                box = QMessageBox(self)
-                box.setIcon(QMessageBox.Critical)
-                box.setText("Directory not found. Import project failed.")
-                box.setInformativeText("Select directory: {}".format(self.image_folder))
-                box.setStandardButtons(QMessageBox.Ok)
-                box.setDefaultButton(QMessageBox.Ok)
-                box.exec()
-
-                return
-
-            else:
-                found, not_found = [], []
-                for file in self.image_files:
-                    if os.path.exists(os.path.join(self.image_folder, file)):
-                        found.append(file)
-                    else:
-                        not_found.append(file)
-
-                self.image_files = found
+        if self.image_folder is not None and not os.path.exists(self.image_folder):  # relative path
+            box = QMessageBox(self)
+            box.setIcon(QMessageBox.Critical)
+            box.setText("Directory not found. Import project failed.")
+            box.setInformativeText("Select directory: {}".format(self.image_folder))
+            box.setStandardButtons(QMessageBox.Ok)
+            box.setDefaultButton(QMessageBox.Ok)
+            box.exec()
 
-                if len(not_found):
-                    box = QMessageBox(self)
-                    box.setIcon(QMessageBox.Warning)
-                    box.setText("{} file(s) in directory \"{}\" cannot be found."
-                                .format(len(not_found), self.image_folder))
-                    box.setInformativeText("Do you want the project to keep them?")
-                    box.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
-                    box.setDefaultButton(QMessageBox.No)
-                    box.setDetailedText(
-                        "The following file(s) cannot be found:\n\n" +
-                        "\n".join(["  - " + f for f in not_found])
-                    )
-                    ret = box.exec()
-                    if ret == QMessageBox.No:
-                        for f in not_found:
-                            self.results["image_files"].pop(f)
+            return
 
-        self.file_list.addFiles(self.image_files)
-        for i, file in enumerate(self.image_files):
-            self.file_list[i].setCheckState(Qt.Checked if self.results["image_files"][file]["labeled"]
-                                            else Qt.Unchecked)
+        self.file_list.addFiles(self.image_files,
+                                [self.results["image_files"][file]["labeled"] for file in self.image_files])
         self.file_list.selectNext()
 
+        # 文件是否存在在后台并发检查，工程可以立即使用，缺失的文件检查到后再在列表中标记
+        self._startExistenceCheck()
+
         box = QMessageBox(self)
         box.setIcon(QMessageBox.Question)
         box.setText("Continue working on this opened project?")
@@ -472,14 +560,116 @@ class MainWindow(QMainWindow):
             self.setClean()
         else:
         	self.setDirty()
+        if recovered:
+            self.setDirty()  # 重放的修改尚未保存到工程文件中
+
+    def _replayRecovery(self, journal: RecoveryJournal) -> set:
+        # 返回重放的图片，没有恢复文件或不恢复时为空
+        if not journal.exists():
+            return set()
+        try:
+            recovery = journal.load()
+        except ValueError:
+            print("[WARNING] [from app] Ignore broken recovery file {}".format(journal.path))
+            return set()
+
+        box = QMessageBox(self)
+        box.setIcon(QMessageBox.Question)
+        box.setText("Unsaved changes to {} image(s) were autosaved at {}.".format(
+            len(recovery["image_files"]), recovery.get("time", "unknown time")))
+        box.setInformativeText("Do you want to recover them? If not, they will be discarded.")
+        box.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+        box.setDefaultButton(QMessageBox.Yes)
+        if box.exec() != QMessageBox.Yes:
+            journal.discard()
+            return set()
+        recovered = journal.replay(self.results, recovery)
+        self.changed_files.update(recovered)
+        return recovered
+
+    def _imagePath(self, file: str):
+        if self.image_folder is not None:  # relative path
+            return os.path.join(self.image_folder, file)
+        else:  # absolute path
+            return file
+
+    def _startExistenceCheck(self):
+        self.existence_checker = ExistenceChecker([self._imagePath(f) for f in self.image_files], self)
+        self.existence_checker.filesMissing.connect(self._markMissingFiles)
+        self.existence_checker.checkFinished.connect(self._existenceCheckFinished)
+
+        progress = QProgressDialog(self.tr("Checking image files..."), self.tr("Cancel"),
+                                   0, len(self.image_files), self)
+        progress.setWindowTitle(self.tr("Open Project"))
+        progress.setWindowModality(Qt.NonModal)
+        progress.setMinimumDuration(500)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        progress.canceled.connect(self.existence_checker.requestInterruption)
+        self.existence_checker.progressChanged.connect(lambda checked, total: progress.setValue(checked))
+        self.existence_checker.finished.connect(progress.deleteLater)
+        self.existence_checker.start()
+
+    def _markMissingFiles(self, indexes: List[int]):
+        if self.sender() is self.existence_checker:
+            self.file_list.setMissing(indexes)
+
+    def _existenceCheckFinished(self, missing: List[int], canceled: bool):
+        if self.sender() is not self.existence_checker or canceled or len(missing) == 0:
+            return
+
+        not_found = [self.image_files[i] for i in missing]
+        box = QMessageBox(self)
+        box.setIcon(QMessageBox.Warning)
+        if self.image_folder is None:  # absolute path
+            box.setText("{} file(s) cannot be found.".format(len(not_found)))
+        else:  # relative path
+            box.setText("{} file(s) in directory \"{}\" cannot be found."
+                        .format(len(not_found), self.image_folder))
+        box.setInformativeText("Do you want the project to keep them?")
+        box.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
+        box.setDefaultButton(QMessageBox.No)
+        box.setDetailedText(
+            "The following file(s) cannot be found:\n\n" +
+            "\n".join(["  - " + f for f in not_found])
+        )
+        ret = box.exec()
+        if ret == QMessageBox.No:
+            self._removeFiles(missing)
+
+    def _removeFiles(self, indexes: List[int]):
+        # 先取消选中，当前的标注会在 _changeFilesSelection() 中保存，移除后再重新选中原来的文件
+        selected = [i.row() for i in self.file_list.selectedIndexes()]
+        current_file = self.image_files[selected[0]] if len(selected) else None
+        self.file_list.clearSelection()
+
+        indexes = set(indexes)
+        for i in indexes:
+            self.results["image_files"].pop(self.image_files[i])
+            self.annotations.remove(self.image_files[i])
+            self.changed_files.add(self.image_files[i])
+        self.image_files = [f for i, f in enumerate(self.image_files) if i not in indexes]
+        self.file_list.removeFiles(list(indexes))
+
+        if current_file in self.results["image_files"]:
+            self.file_list.selectRow(self.image_files.index(current_file))
+        else:
+            # 当前打开的文件被移除，打开剩下的第一个文件
+            self._replaceCanvasShapes(self.canvas.clear)
+            self.file_list.selectNext()
+        self.setDirty()
 
     def importImages(self, paths: List[str]):
         if len(paths) == 0:
             return
 
         # clean the current content
+        self._stopBackgroundTasks()
         self.file_list.clear()
-        self.canvas.clear()
+        self._replaceCanvasShapes(self.canvas.clear)
+        self.annotations.clear()
+        self._closeProject()
+        self.changed_files.clear()
 
         self.image_folder = None
         self.image_files = paths
@@ -503,41 +693,108 @@ class MainWindow(QMainWindow):
             return
 
         # clean the current content
+        self._stopBackgroundTasks()
         self.file_list.clear()
-        self.canvas.clear()
-        # self.label_list.clear()
-        # label_list will automatically clear since its .removeShapes()
-        # has been connected to canvas' .removeShapes()
+        self._replaceCanvasShapes(self.canvas.clear)
+        self.annotations.clear()
+        # label_list will automatically clear since it shares canvas' shape store
+
+        self._closeProject()
+        self.changed_files.clear()
 
-        # load new files
+        # load new files, the file list is populated progressively by the background scanner
         self.image_folder = path
         self.image_files = []
-        for ext in IMAGE_EXTENTIONS:  # ["jpg", "png"]
-            self.image_files.extend(glob.glob(os.path.join(
-                self.image_folder,
-                "*.{}".format(ext)
-            )))
-        self.image_files = [os.path.split(f)[-1] for f in self.image_files]  # remove dir
-        self.image_files.sort()
-        self.file_list.addFiles(self.image_files)
         self.results = {
             "image_folder": path,
-            "image_files": {
-                f: {
-                    "labeled": False,
-                    "shapes": []
-                } for f in self.image_files
-            }
+            "image_files": {}
         }
-        self.file_list.selectNext()
+        self.scan_opened_file = None
+        # 没有工程文件时自动保存到按图片目录区分的恢复文件，再次打开同一目录时可以恢复；
+        # 重放的记录先放入 results，扫描到对应的文件时不再覆盖
+        self.folder_recovery = RecoveryJournal.forImageFolder(path)
+        self.scan_recovered = self._replayRecovery(self.folder_recovery)
+        self.dir_scanner = DirScanner(path, self.image_extensions, self.scan_recursive, self)
+        self.dir_scanner.filesFound.connect(self._addScannedFiles)
+        self.dir_scanner.scanFinished.connect(self._dirScanFinished)
+        self.dir_scanner.start()
         self.setDirty()
 
+    def _addScannedFiles(self, files: List[str]):
+        if self.sender() is not self.dir_scanner:
+            return  # 已经被取消的扫描
+        # 每一批只在内部排序，合并后整个列表重新按文件名排序，与一次性载入时的顺序相同
+        self.image_files.extend(files)
+        self.image_files.sort()
+        image_files = self.results["image_files"]
+        for f in files:
+            if f not in image_files:  # 从恢复文件中重放的记录已经在 results 中
+                image_files[f] = {
+                    "labeled": False,
+                    "shapes": []
+                }
+        self.scan_recovered.difference_update(files)
+        self.file_list.mergeFiles(files, [image_files[f]["labeled"] for f in files])
+
+        selected = self.file_list.selectedIndexes()
+        if len(selected) == 0:
+            self.file_list.selectNext()  # 第一批文件到达时就打开第一张图片
+            self.scan_opened_file = self.image_files[0]
+            if self.changed_files:
+                self.setDirty()  # 重放的修改尚未保存到工程文件中
+        elif self.scan_opened_file is not None and selected[0].row() != 0:
+            if self.image_files[selected[0].row()] == self.scan_opened_file and len(self.canvas.store) == 0:
+                # 还停留在自动打开的图片上且没有标注，改为打开现在排在第一的图片
+                self.file_list.selectRow(0)
+                self.scan_opened_file = self.image_files[0]
+            else:
+                self.scan_opened_file = None  # 用户已经切换图片或开始标注
+
+    def _dirScanFinished(self, total: int):
+        if self.sender() is not self.dir_scanner:
+            return
+        if self.scan_recovered:
+            # 恢复文件中有、但目录中已经不存在的图片
+            print("[WARNING] [from app] Drop {} recovered image(s) not found in {}".format(
+                len(self.scan_recovered), self.image_folder))
+            for f in self.scan_recovered:
+                self.results["image_files"].pop(f, None)
+                self.changed_files.discard(f)
+            self.scan_recovered = set()
+        self.statusBar().showMessage(self.tr("{} image(s) found in {}").format(total, self.image_folder), 5000)
+
+    def _stopBackgroundTasks(self):
+        if self.dir_scanner is not None:
+            self.dir_scanner.stop()
+            self.dir_scanner.deleteLater()
+            self.dir_scanner = None
+        self.scan_recovered = set()
+        if self.existence_checker is not None:
+            self.existence_checker.stop()
+            self.existence_checker.deleteLater()
+            self.existence_checker = None
+
+    def _closeProject(self):
+        self.saver.waitForDone()
+        # 处理已完成的写入的结果（保存成功后删除恢复文件等）
+        QCoreApplication.sendPostedEvents(self, QEvent.MetaCall)
+        self._closeRetiredProjects()
+        if self.project is not None:
+            self.project.close()
+            self.project = None
+        self.folder_recovery = None
+
+    def _closeRetiredProjects(self):
+        for project in self.retired_projects:
+            project.close()
+        self.retired_projects.clear()
+
     def openNextImg(self):
         print("[INFO] Open next image triggered.")
         current_select, next_select = self.file_list.selectNext()
         # self.changeFilesSelection() will be triggered to process canvas.
         if current_select is not None:
-            self.file_list[current_select].setCheckState(Qt.Checked)
+            self.file_list.setLabeled(current_select, True)
             # may trigger setDirty() if check state changes
 
     def openPrevImg(self):
@@ -545,16 +802,21 @@ class MainWindow(QMainWindow):
         current_select, prev_select = self.file_list.selectPrev()
         # self._changeFilesSelection() will be triggered to process canvas.
         if current_select is not None:
-            self.file_list[current_select].setCheckState(Qt.Checked)
+            self.file_list.setLabeled(current_select, True)
 
     def saveProject(self):
         print("[INFO] [from app] Saving current work...")
         selected = [i.row() for i in self.file_list.selectedIndexes()]
         assert len(selected) <= 1, "Single selection mode."
+        self.changed_files.update(self.annotations.exportTo(self.results))
         if len(selected):
             current_file = self.image_files[selected[0]]
-            self.results["image_files"][current_file]["shapes"] = self.canvas.exportShapes()
-            self.file_list[selected[0]].setCheckState(Qt.Checked)
+            if self.shapes_modified:
+                # 只写入实际修改过的图片，保存的数据量与修改量有关，与浏览过多少图片无关
+                self.results["image_files"][current_file]["shapes"] = self.canvas.exportShapes()
+                self.changed_files.add(current_file)
+                self.shapes_modified = False
+            self.file_list.setLabeled(selected[0], True)
 
         if self.output_folder is None:
             self.output_folder = self.openDirDialog()
@@ -562,15 +824,100 @@ class MainWindow(QMainWindow):
                 return None  # cancel saving if None selected
 
             time_stamp = time.strftime("%m%d%H%M%S", time.localtime())
-            self.output_name = "proj_" + time_stamp + ".json"
+            self.output_name = "proj_" + time_stamp + self.project_suffix
 
         path = os.path.join(self.output_folder, self.output_name)
         print("[INFO] [from app] Saving project to {}...".format(path))
-        with open(path, "w", encoding="utf-8") as j:
-            json.dump(self.results, j, ensure_ascii=False, indent=4)
+        # 只追加上次保存之后改变过的图片；换了保存路径时写完整的快照
+        if self.project is None or os.path.abspath(self.project.path) != os.path.abspath(path):
+            if self.project is not None:
+                self.retired_projects.append(self.project)
+            self.project = open_project(path)
+        # 在 GUI 线程中只复制改变过的记录，序列化和写入在后台线程中进行
+        self._writeProject(self.changed_files)
+        self.changed_files.clear()
         self.setClean()  # set clean, no unsaved changes
+        self.statusBar().showMessage(self.tr("Saving project to {}...").format(path))
         return path
 
+    def autosave(self):
+        # 只在上次自动保存之后有修改、并且上一次写入已经完成时进行，不会阻塞交互
+        journal = self._recoveryJournal()
+        if not self.autosave_needed or journal is None or self.saver.isBusy():
+            return
+        self.changed_files.update(self.annotations.exportTo(self.results))
+        selected = [i.row() for i in self.file_list.selectedIndexes()]
+        if len(selected) and self.shapes_modified:  # 只是浏览过的图片不写入恢复文件
+            current_file = self.image_files[selected[0]]
+            self.results["image_files"][current_file]["shapes"] = self.canvas.exportShapes()
+            self.changed_files.add(current_file)
+        self.autosave_needed = False
+        if not self.changed_files:
+            return
+        self.saver.save(journal,
+                        snapshot_results(self.results, self.changed_files, full=False), set(self.changed_files))
+
+    def _recoveryJournal(self):
+        # 有工程文件时恢复文件在工程文件旁边，否则使用按图片目录区分的默认位置；都没有时为 None
+        if self.project is not None:
+            return RecoveryJournal(self.project.path)
+        return self.folder_recovery
+
+    def _discardRecovery(self):
+        self.saver.waitForDone()
+        if self.project is not None:
+            RecoveryJournal(self.project.path).discard()
+        self._discardFolderRecovery()
+
+    def _discardFolderRecovery(self):
+        if self.folder_recovery is not None:
+            self.folder_recovery.discard()
+            self.folder_recovery = None
+
+    def _writeProject(self, changed_files):
+        # 是否写完整的快照在这里决定，后台线程只写入快照中已有的内容
+        full = self.project.needsFullSave()
+        self.project.float32 = self.float32_grasps
+        snapshot = snapshot_results(self.results, changed_files, full)
+        self.saver.save(self.project, snapshot, None if full else set(changed_files))
+
+    def _projectSaved(self, project, files: set, error: str):
+        if isinstance(project, RecoveryJournal):
+            if error:
+                self.autosave_needed = True
+                self.statusBar().showMessage(self.tr("Autosave failed: {}").format(error), 5000)
+            return
+
+        if error:
+            if project is self.project:
+                # 没有写入的图片在下次保存时重新写入
+                self.changed_files.update(files or ())
+                self.setDirty()
+            box = QMessageBox(self)
+            box.setIcon(QMessageBox.Critical)
+            box.setText("Saving project failed.")
+            box.setInformativeText("{}\n\n{}".format(project.path, error))
+            box.setStandardButtons(QMessageBox.Ok)
+            box.setDefaultButton(QMessageBox.Ok)
+            box.exec()
+            return
+
+        image_files = self.results["image_files"]
+        if project is self.project and isinstance(image_files, LazyImageFiles):
+            # 已写入的记录之后可以从工程文件中重新读取；写入之后又改变过的记录仍然保留在内存中
+            image_files.source = project
+            image_files.release([f for f in (image_files if files is None else files) if f not in self.changed_files])
+        if project is self.project:
+            # 默认位置的恢复文件中的修改都已写入工程文件，之后的自动保存写到工程文件旁边
+            self._discardFolderRecovery()
+        if project is self.project and not self.changed_files:
+            # 所有修改都已写入工程文件，不再需要恢复文件
+            RecoveryJournal(project.path).discard()
+        if not self.saver.isBusy():
+            # 形状已经改为从新工程中读取，旧工程不再被使用（释放文件句柄，Windows 上旧文件不再被占用）
+            self._closeRetiredProjects()
+            self.statusBar().showMessage(self.tr("Project saved to {}").format(project.path), 5000)
+
     def changeOutputDir(self):
         self.output_folder = self.openDirDialog()
         return self.output_folder
@@ -604,10 +951,19 @@ class MainWindow(QMainWindow):
                 else:
                     e.accept()
             elif ret == QMessageBox.No:
+                self._discardRecovery()  # 放弃未保存的修改
                 e.accept()
             else:
                 e.ignore()
 
+        if e.isAccepted():
+            self._stopBackgroundTasks()
+            self.autosave_timer.stop()
+            self._closeProject()
+            self.saver.shutdown()
+            self.prefetcher.shutdown()
+            self.annotations.clear()  # 删除溢出到磁盘的临时文件
+
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
@@ -4,13 +4,18 @@ from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 
-from grasp import GraspRect, GraspRectBuilder
+from grasp import GraspRect, GraspRectBuilder, GraspRectDispConfig, GraspBatch, GraspHitTester
+from spatial_index import GridIndex
+from shape_store import ShapeStore
+from image_cache import read_scaled_image
+from image_pyramid import ImagePyramid
 
 
 class PainterGen(object):
     def __init__(self):
         self.origin = QPointF(0., 0.)
         self.scale = 1.
+        self.fast = False  # 平移 / 缩放过程中关闭抗锯齿和平滑缩放
         # self.base_scale = 1.
 
     # def setBaseScale(self, base_scale=1.0):
@@ -43,15 +48,27 @@ class PainterGen(object):
         else:
             self.origin += delta_pos * self.scale
 
+    def painterRectToWidget(self, rect: QRectF) -> QRectF:
+        return QRectF(rect.topLeft() * self.scale + self.origin, rect.size() * self.scale)
+
+    def widgetRectToPainter(self, rect: QRectF) -> QRectF:
+        return QRectF(self.widgetToPainter(rect.topLeft()), rect.size() / self.scale)
+
     def getPainter(self, device):
         painter = QPainter(device)
+        self.setupPainter(painter)
+        return painter
+
+    def setupPainter(self, painter: QPainter):
         painter.translate(self.origin)
         painter.scale(self.scale, self.scale)
 
-        painter.setRenderHint(QPainter.Antialiasing)
-        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        if not self.fast:
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
 
-        return painter
+    def transformKey(self):
+        return self.origin.x(), self.origin.y(), self.scale
 
     def fitWidgetWidth(self, widget_size: QSize, image_size: QSize):
         widget_width, widget_height = widget_size.width(), widget_size.height()
@@ -104,9 +121,14 @@ class Canvas(QWidget):
     # (selected, deselected)， list of shape id
     shapesSelectionChanged = pyqtSignal(list, list)
     shapesAreaChanged = pyqtSignal(list)  # list of shapes (GraspRect)
+    shapesEditFinished = pyqtSignal()  # 鼠标释放，一次拖动 / 旋转结束
+    shapesOrderChanged = pyqtSignal()
 
     CREATE, EDIT = 0, 1
 
+    DEFAULT_FRAME_RATE = 60
+    FAST_RENDER_IDLE = 150  # ms
+
     def __init__(self, parent=None):
         super(QWidget, self).__init__(parent)
         # self.setGeometry(10, 10, 1200, 800)
@@ -116,60 +138,128 @@ class Canvas(QWidget):
 
         self.mode = self.EDIT
         self.pre_pos = None
-        self.pixmap = None  # QPixmap("./19.jpg")
+        self.pyramid = None  # ImagePyramid
 
-        # 使用字典存储shape的id到列表下标的映射，加快处理速度
-        self.shapes = list()
-        self.id2idx = dict()
+        # 与形状列表共享的有序形状存储（shapes 列表以及 id 到下标的映射）
+        self.store = ShapeStore(self)
+        self.store.shapesOrderChanged.connect(self._shapesOrderChangedEmit)
+        self.store.shapeVisibleChanged.connect(self._shapeVisibleChanged)
 
         self.pg = PainterGen()
         self.builder = GraspRectBuilder()
 
+        # 所有形状的向量化命中测试，以及当前指针停留的形状（最多一个）
+        self.hit_tester = GraspHitTester()
+        self._hovering_shape = None
+
+        # 形状包围盒的空间索引（key 为 shape id），查询时只测试鼠标附近的形状
+        self.spatial_index = GridIndex()
+
+        # 分层绘制：图像和所有非活动形状缓存在静态层中，只在变换改变或相关区域变化时重新绘制；
+        # 活动形状（指针停留或选中）和 builder 的预览每次都实时绘制在静态层之上
+        self._static_layer = None
+        self._static_layer_key = None
+        self._static_dirty = QRegion()
+        self._active_ids = set()
+        # 视口中的形状是否多到只画轮廓；在整个静态层重绘时决定，局部重绘沿用，保证整个视口的绘制方式一致
+        self._outline_only = False
+
+        # 鼠标移动事件的合并：只记录最新的指针位置，每帧最多处理一次
+        self.frame_rate = self.DEFAULT_FRAME_RATE
+        self._pending_move = None  # (pos, buttons, button)
+        self._move_timer = QTimer(self)
+        self._move_timer.setSingleShot(True)
+        self._move_timer.timeout.connect(self._flushMouseMove)
+        self._frame_clock = QElapsedTimer()
+        self._frame_clock.start()
+
+        # 平移 / 缩放时使用快速绘制，停止操作一段时间后再以完整质量重新绘制
+        self._quality_timer = QTimer(self)
+        self._quality_timer.setSingleShot(True)
+        self._quality_timer.setInterval(self.FAST_RENDER_IDLE)
+        self._quality_timer.timeout.connect(self._restoreRenderQuality)
+
+    def decodeSize(self) -> QSize:
+        # 适应窗口时需要的图片分辨率（设备像素），按此大小解码即可，放大后再按需解码图块
+        return self.size() * self.devicePixelRatioF()
+
     def loadImage(self, path: str):
-        self.pixmap = QPixmap(path)
+        self.setImage(read_scaled_image(path, self.decodeSize()), path)
+
+    def setImage(self, image: QImage, path: str = None):
+        """
+        :param image: 图片，可以是按 decodeSize() 缩小解码的版本
+        :param path: 图片文件路径，放大时从中解码更高分辨率的图块
+        """
+        if self.pyramid is not None:
+            self.pyramid.close()
+            self.pyramid.deleteLater()
+        self.pyramid = ImagePyramid(image, path, self)
+        self.pyramid.tileLoaded.connect(lambda rect: self._updatePainterRect(rect, rect))
+        self._static_layer = None
         self.adjustPainter("fit_window")
 
     def addShapes(self, shapes: list):
-        added_shapes = []
-        for shape in shapes:
-            assert isinstance(shape, GraspRect)
-            if shape.id() not in self.id2idx:
-                shape.resetChanged()
-                self.id2idx[shape.id()] = len(self.shapes)
-                self.shapes.append(shape)
-                added_shapes.append(shape)
+        added_shapes = self.store.addShapes(shapes)
+        for shape in added_shapes:
+            shape.resetChanged()
 
         if added_shapes:
+            self.hit_tester.invalidate()
+            self.spatial_index.insertMany(
+                [shape.id() for shape in added_shapes],
+                GraspBatch.computeBoundingBoxes(np.array([shape._points for shape in added_shapes]))
+            )
             print("[INFO] [from canvas] Emit shapesAdded, ids = {}"
                   .format([shape.id() for shape in added_shapes]))
             self.shapesAdded.emit(added_shapes)
-            self.update()
+            self._updateShapes(added_shapes)
 
     def removeShapes(self, shape_ids: list):
-        removed_shape_ids = []
-        removed_indexes = []
-        for shape_id in shape_ids:
-            if shape_id in self.id2idx:
-                idx = self.id2idx.pop(shape_id)
-                removed_indexes.append(idx)
-                removed_shape_ids.append(shape_id)
-
-        for idx in sorted(removed_indexes, reverse=True):
-            self.shapes.pop(idx)
+        removed_shapes = self.store.removeShapes(shape_ids)
+        removed_shape_ids = [shape.id() for shape in removed_shapes]
+        dirty = QRectF()
+        if removed_shapes and len(self.store) == 0:
+            # 全部移除（例如切换图片）时不必逐个计算重绘区域，直接重绘整个静态层
+            self.spatial_index.clear()
+            self._active_ids.clear()
+            self._static_layer = None
+            self.update()
+        else:
+            for shape in removed_shapes:
+                self.spatial_index.remove(shape.id())
+                self._active_ids.discard(shape.id())
+                dirty = dirty.united(shape.takeDirtyRect())
 
         if removed_shape_ids:
-            self.id2idx = {shape.id(): i for i, shape in enumerate(self.shapes)}
+            self.hit_tester.invalidate()
+            if self._hovering_shape is not None and self._hovering_shape.id() not in self.store.id2idx:
+                self._hovering_shape = None
             print("[INFO] [from canvas] Emit shapesRemoved, ids = {}"
                   .format(removed_shape_ids))
             self.shapesRemoved.emit(removed_shape_ids)
-            self.update()
+            self._updatePainterRect(dirty, dirty)
 
     def clear(self):
         self.builder.reset()
-        self.removeShapes(list(self.id2idx.keys()))
+        self.removeShapes(list(self.store.id2idx.keys()))
+
+    def takeShapes(self):
+        """移出并返回当前所有形状（活动对象），交互状态（选中、悬停）会被清除"""
+        shapes = list(self.store.shapes)
+        for shape in shapes:
+            shape.resetSelected()
+            shape.resetHovering()
+        self.clear()
+        return shapes
+
+    def setShapes(self, shapes: list):
+        # 用已有的形状对象替换当前所有形状，不重新计算几何，id 保持不变
+        self.clear()
+        self.addShapes(shapes)
 
     def exportShapes(self):
-        return [s.export() for s in self.shapes]
+        return GraspBatch.fromShapes(self.store.shapes).export()
 
     def loadShapes(self, shapes):
         # shapes: list[dict], e.g.:
@@ -179,55 +269,50 @@ class Canvas(QWidget):
         #     ...
         # ],
         self.clear()
-        self.addShapes([GraspRect(np.array(shape["points"])) for shape in shapes])
+        self.addShapes(GraspBatch.fromExported(shapes).toShapes())
 
     def changeShapesSelection(self, select: list, deselect: list):
+        changed_shapes = []
         for shape_id in select:
-            if shape_id not in self.id2idx:
+            if shape_id not in self.store.id2idx:
                 continue
-            idx = self.id2idx[shape_id]
-            shape = self.shapes[idx]
+            idx = self.store.id2idx[shape_id]
+            shape = self.store.shapes[idx]
             shape.setSelected(True)
+            changed_shapes.append(shape)
 
         for shape_id in deselect:
-            if shape_id not in self.id2idx:
+            if shape_id not in self.store.id2idx:
                 continue
-            idx = self.id2idx[shape_id]
-            shape = self.shapes[idx]
+            idx = self.store.id2idx[shape_id]
+            shape = self.store.shapes[idx]
             shape.setSelected(False)
+            changed_shapes.append(shape)
 
         self._checkShapesSelectionChangeAndEmit()
-        self.update()
+        self._updateShapes(changed_shapes)
 
     def changeShapesVisible(self, shape_id: str, visible: bool):
-        if shape_id in self.id2idx:
-            idx = self.id2idx[shape_id]
-            shape = self.shapes[idx]
-            shape.setVisible(visible)
-            self.update()
+        self.store.setVisible(shape_id, visible)
 
-    def changeShapesOrder(self, old_id2idx: dict, new_id2idx: dict):
-        if self.id2idx == old_id2idx:
-            if old_id2idx == new_id2idx:
-                print("[INFO] [from canvas] Shapes order not change, no need to reorder")
-            else:
-                new_shapes = [None] * len(self.shapes)
-                for shape_id, new_idx in new_id2idx.items():
-                    old_idx = self.id2idx[shape_id]
-                    new_shapes[new_idx] = self.shapes[old_idx]
-                self.shapes = new_shapes
-                self.id2idx = new_id2idx
-        else:
-            if self.id2idx == new_id2idx:
-                print("[INFO] [from canvas] Already the newest order")
-            else:
-                raise ValueError("[ERROR] [from canvas] Shapes order mess up!")
+    def _shapeVisibleChanged(self, shape_id: str, visible: bool):
+        # 可见性由形状列表的勾选框或 changeShapesVisible() 经 store 修改
+        self.hit_tester.invalidate()
+        self._updateShapes([self.store.shape(shape_id)])
+
+    def _shapesOrderChangedEmit(self):
+        # 形状列表中拖放排序后，store 中的顺序（即图层顺序）已经改变
+        self.hit_tester.invalidate()
+        self._static_layer = None
+        self.update()
+        print("[INFO] [from canvas] Emit shapesOrderChanged")
+        self.shapesOrderChanged.emit()
 
     def _checkShapesSelectionChangeAndEmit(self):
         # 鼠标按键操作会导致形状选中状态的改变，或者从CREATE切换至MODE也会导致选中状态的改变
         new_select_shape_ids = []
         new_deselect_shape_ids = []
-        for shape in self.shapes:
+        for shape in self.store.shapes:
             assert isinstance(shape, GraspRect)
             if shape.selectedChanged():
                 if shape.selected():
@@ -241,42 +326,159 @@ class Canvas(QWidget):
                   "select = {}, deselect = {}".format(new_select_shape_ids, new_deselect_shape_ids))
             self.shapesSelectionChanged.emit(new_select_shape_ids, new_deselect_shape_ids)
 
-    def _checkShapesAreaChangeAndEmit(self):
-        # 鼠标的移动可能会导致形状的改变
+    def _checkShapesAreaChangeAndEmit(self, shapes: list = None):
+        # 鼠标的移动可能会导致形状的改变；shapes 为可能改变的形状，None 时检查所有形状
         new_modified_shapes = []
-        for shape in self.shapes:
+        new_modified_indexes = []
+        if shapes is None:
+            indexed = enumerate(self.store.shapes)
+        else:
+            indexed = ((self.store.id2idx[shape.id()], shape) for shape in shapes)
+        for i, shape in indexed:
             assert isinstance(shape, GraspRect)
             if shape.areaChanged():
                 new_modified_shapes.append(shape)
+                new_modified_indexes.append(i)
                 shape.resetAreaChanged()
 
         if new_modified_shapes:
+            self.hit_tester.updateShapes(new_modified_indexes, self.store.shapes)
+            for shape in new_modified_shapes:
+                self.spatial_index.update(shape.id(), shape.boundingBox())
             print("[INFO] [from canvas] Emit shapesAreaChanged, ids = {}"
                   .format([shape.id() for shape in new_modified_shapes]))
             self.shapesAreaChanged.emit(new_modified_shapes)
 
     def _resetSelectedExcept(self, s: GraspRect = None):
-        for shape in self.shapes:
+        for shape in self.store.shapes:
             if (s is None) or (s.id() != shape.id()):
                 shape.resetSelected()
 
     def _resetHoveringExcept(self, s: GraspRect = None):
-        for shape in self.shapes:
-            if (s is None) or (s.id() != shape.id()):
-                shape.resetHovering()
+        # 只有 self._hovering_shape 可能处于指针停留状态
+        if (self._hovering_shape is not None) and (self._hovering_shape is not s):
+            self._hovering_shape.resetHovering()
+            self._hovering_shape = None
+
+    def _activeShapes(self):
+        # 指针停留或选中的形状，按图层顺序排列；拖动只会改变选中的形状
+        return [self.store.shapes[self.store.id2idx[shape_id]]
+                for shape_id in sorted(self._active_ids, key=self.store.id2idx.get)]
+
+    def shapeIndexesInRect(self, rect: QRectF):
+        """包围盒与 painter 坐标系下的矩形相交的形状下标，按图层顺序（从下到上）排列"""
+        shape_ids = self.spatial_index.queryRect(rect.left(), rect.top(), rect.right(), rect.bottom())
+        return sorted(self.store.id2idx[shape_id] for shape_id in shape_ids)
+
+    def _candidatesAt(self, painter_pos: QPointF):
+        # 只有包围盒（加上选择容差）覆盖鼠标位置的形状才可能被命中
+        radius = max(GraspRect.vertex_select_tolerance, GraspRect.edge_select_tolerance)
+        shape_ids = self.spatial_index.queryPoint(painter_pos.x(), painter_pos.y(), radius)
+        return [self.store.id2idx[shape_id] for shape_id in shape_ids]
+
+    def _hoverAt(self, painter_pos: QPointF):
+        idx, point_idx, edge_idx = self.hit_tester.hitTest(
+            self.store.shapes, painter_pos, candidates=self._candidatesAt(painter_pos))
+        if idx is None:
+            self._resetHoveringExcept(None)
+        else:
+            shape = self.store.shapes[idx]
+            self._resetHoveringExcept(shape)
+            shape.setHoveringPart(True, point_idx, edge_idx)
+            self._hovering_shape = shape
+
+    def _updatePainterRect(self, rect: QRectF, static_dirty=QRectF()):
+        # rect: 需要重绘的区域，static_dirty: 其中静态层也需要重新绘制的区域，均为 painter 坐标系
+        if not static_dirty.isEmpty():
+            # 多留出几个像素给抗锯齿
+            self._static_dirty += self.pg.painterRectToWidget(static_dirty).toAlignedRect().adjusted(-2, -2, 2, 2)
+        if not rect.isEmpty():
+            self.update(self.pg.painterRectToWidget(rect).toAlignedRect().adjusted(-2, -2, 2, 2))
+
+    def _updateShapes(self, shapes: list = None):
+        # 只重绘显示状态（指针停留、选中、几何、可见性）发生改变的形状的新旧区域，以及 builder 的预览
+        # shapes 为 None 时检查所有形状
+        dirty = QRectF()
+        static_dirty = QRectF()
+        for shape in (self.store.shapes if shapes is None else shapes):
+            if shape.displayChanged():
+                rect = shape.takeDirtyRect()
+                dirty = dirty.united(rect)
+
+                # 形状在活动与非活动之间切换，或者非活动形状本身改变时，静态层中对应的区域需要重新绘制
+                active = shape.hoveringAnything() or shape.selectedAnything()
+                if active:
+                    if shape.id() not in self._active_ids:
+                        self._active_ids.add(shape.id())
+                        static_dirty = static_dirty.united(rect)
+                else:
+                    self._active_ids.discard(shape.id())
+                    static_dirty = static_dirty.united(rect)
 
-    def _setShapeCursorPos(self, pos: QPointF):
-        for shape in self.shapes:
+        dirty = dirty.united(self.builder.dirtyRect())
+        self._updatePainterRect(dirty, static_dirty)
+
+    def _setShapeCursorPos(self, pos: QPointF, shapes: list = None):
+        # 指针位置只在拖动选中的形状时使用；按下鼠标时更新所有形状，移动时只需更新活动形状
+        for shape in (self.store.shapes if shapes is None else shapes):
             shape.setCursorPos(pos)
 
-    def paintEvent(self, e: QMouseEvent) -> None:
-        painter = self.pg.getPainter(self)
+    def _renderStaticLayer(self):
+        dpr = self.devicePixelRatioF()
+        key = self.pg.transformKey() + (self.width(), self.height(), dpr, self.pg.fast)
+
+        if (self._static_layer is None) or (self._static_layer_key != key):
+            self._static_layer = QPixmap(self.size() * dpr)
+            self._static_layer.setDevicePixelRatio(dpr)
+            self._static_layer_key = key
+            region = QRegion(self.rect())
+            full = True
+        elif not self._static_dirty.isEmpty():
+            region = self._static_dirty
+            full = False
+        else:
+            return
+        self._static_dirty = QRegion()
+
+        painter = QPainter(self._static_layer)
+        painter.setClipRegion(region)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        painter.fillRect(region.boundingRect(), Qt.transparent)
+        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        self.pg.setupPainter(painter)
+
+        exposed = self.pg.widgetRectToPainter(QRectF(region.boundingRect()))
+        if self.pyramid is not None:
+            self.pyramid.paint(painter, exposed, self.pg.scale * dpr)
+
+        # 视口裁剪：只绘制与需要重绘的区域（全部重绘时即整个视口）相交的形状
+        pad = GraspRect.paintPadding()
+        indexes = [idx for idx in self.shapeIndexesInRect(exposed.adjusted(-pad, -pad, pad, pad))
+                   if self.store.shapes[idx].visible() and (self.store.shapes[idx].id() not in self._active_ids)]
+
+        if full:
+            self._outline_only = len(indexes) > GraspRectDispConfig.lod_simplify_count
+
+        if indexes:
+            self.hit_tester.sync(self.store.shapes)
+            if self._outline_only:
+                GraspRect.paintOutlines(painter, self.hit_tester.edges(indexes))
+            else:
+                small = self.hit_tester.extents(indexes) * self.pg.scale < GraspRectDispConfig.lod_min_screen_size
+                for idx, is_small in zip(indexes, small.tolist()):
+                    self.store.shapes[idx].paint(painter, GraspRectDispConfig.LOD_OUTLINE if is_small
+                                           else GraspRectDispConfig.LOD_FULL)
+        painter.end()
+
+    def paintEvent(self, e: QPaintEvent) -> None:
+        self._renderStaticLayer()
 
-        if self.pixmap is not None:
-            painter.drawPixmap(0, 0, self.pixmap)
+        # 系统裁剪区域已经限制为需要重绘的区域
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self._static_layer)
 
-        for shape in self.shapes:
-            assert isinstance(shape, GraspRect)
+        self.pg.setupPainter(painter)
+        for shape in self._activeShapes():
             shape.paint(painter)
 
         self.builder.paint(painter)
@@ -288,7 +490,33 @@ class Canvas(QWidget):
         #     painter.setPen(QPen(Qt.yellow, 50))
         #     painter.drawPoint(0, 0)
 
+    def _startFastRender(self):
+        self.pg.fast = True
+        self._quality_timer.start()
+
+    def _restoreRenderQuality(self):
+        self.pg.fast = False
+        self.update()
+
+    def setFrameRate(self, frame_rate):
+        self.frame_rate = max(1, int(frame_rate))
+        print("[INFO] [from canvas] Frame rate set to {}".format(self.frame_rate))
+
+    def frameInterval(self):
+        return 1000. / self.frame_rate  # ms
+
+    def _flushMouseMove(self):
+        # 处理合并后的最新一次鼠标移动，按下、释放、滚轮等事件之前也要先调用以保证顺序
+        self._move_timer.stop()
+        if self._pending_move is None:
+            return
+        pos, buttons, button = self._pending_move
+        self._pending_move = None
+        self._frame_clock.restart()
+        self._processMouseMove(pos, buttons, button)
+
     def mousePressEvent(self, e: QMouseEvent) -> None:
+        self._flushMouseMove()
         pos = e.localPos()
         painter_pos = self.pg.widgetToPainter(pos)
         press_control = int(e.modifiers()) & Qt.ControlModifier
@@ -308,98 +536,106 @@ class Canvas(QWidget):
             # ctrl + 左键 多选
             if press_control:
                 if e.button() == Qt.LeftButton:
-                    for shape in reversed(self.shapes):
-                        assert isinstance(shape, GraspRect)
-                        if not shape.visible():
-                            continue
-                        if not shape.selected():
-                            shape.checkPosAndSelect(painter_pos, shape_only=True)
-                            if shape.selected():
-                                break
-
-            else:  # 否则单选判断
-                for shape in reversed(self.shapes):
-                    assert isinstance(shape, GraspRect)
-                    if not shape.visible():
-                        continue
-                    # 左键单击看判断点线面，右键单击时只判断是否在面内
-                    if e.button() == Qt.LeftButton:
-                        shape.checkPosAndSelect(painter_pos, shape_only=False)
-                    elif e.button() == Qt.RightButton:
-                        shape.checkPosAndSelect(painter_pos, shape_only=True)
-                    if shape.selectedAnything():
-                        self._resetSelectedExcept(shape)
-                        self._resetHoveringExcept(shape)
-                        break
+                    # 选中最上层的、尚未被选中的形状
+                    candidates = [i for i in self._candidatesAt(painter_pos) if not self.store.shapes[i].selected()]
+                    idx, _, _ = self.hit_tester.hitTest(self.store.shapes, painter_pos, shape_only=True,
+                                                        candidates=candidates)
+                    if idx is not None:
+                        self.store.shapes[idx].setSelectedPart(True)
+
+            elif e.button() in (Qt.LeftButton, Qt.RightButton):  # 否则单选判断
+                # 左键单击看判断点线面，右键单击时只判断是否在面内
+                idx, point_idx, edge_idx = self.hit_tester.hitTest(
+                    self.store.shapes, painter_pos, shape_only=(e.button() == Qt.RightButton),
+                    candidates=self._candidatesAt(painter_pos))
+                if idx is not None:
+                    shape = self.store.shapes[idx]
+                    shape.setSelectedPart(True, point_idx, edge_idx)
+                    self._resetSelectedExcept(shape)
+                    self._resetHoveringExcept(shape)
+                else:
+                    for shape in self.store.shapes:
+                        if shape.visible():
+                            shape.resetSelected()
             self._checkShapesSelectionChangeAndEmit()
 
         self._setShapeCursorPos(painter_pos)
         self.pre_pos = pos
-        self.update()
+        self._updateShapes()
 
     def mouseReleaseEvent(self, e: QMouseEvent) -> None:
+        self._flushMouseMove()
         painter_pos = self.pg.widgetToPainter(e.localPos())
         if self.mode == self.EDIT:
             if e.button() == Qt.LeftButton:
-                for shape in self.shapes:
-                    shape._selected_point_idx = None
-                    shape._selected_edge_idx = None
-                for shape in reversed(self.shapes):
-                    shape.checkPosAndHover(painter_pos, shape_only=False)
-                    if shape.hoveringAnything():
-                        self._resetHoveringExcept(shape)
-                        break
+                for shape in self.store.shapes:
+                    if shape.selectedAnything():
+                        shape.setSelectedPart(shape.selected())
+                self._hoverAt(painter_pos)
 
         self.pre_pos = None
-        self.update()
+        self._updateShapes()
+        self.shapesEditFinished.emit()
 
     def mouseMoveEvent(self, e: QMouseEvent) -> None:
-        pos = e.localPos()
+        # 高回报率的鼠标产生事件的速度远高于屏幕刷新率，这里只记录位置，由定时器按帧率处理
+        self._pending_move = (QPointF(e.localPos()), e.buttons(), e.button())
+        if not self._move_timer.isActive():
+            remaining = self.frameInterval() - self._frame_clock.elapsed()
+            self._move_timer.start(max(0, int(remaining)))
+
+    def _processMouseMove(self, pos: QPointF, buttons: Qt.MouseButtons, button: Qt.MouseButton):
         painter_pos = self.pg.widgetToPainter(pos)
 
-        if int(e.buttons()) & Qt.MidButton:
+        if int(buttons) & Qt.MidButton:
             delta_pos = pos - self.pre_pos
             self.pg.move(delta_pos, widget_logic=True)
+            self._startFastRender()
+            self.update()
 
         else:
             painter_pos = self.pg.widgetToPainter(pos)  # 要放在self.pg更新之后
             if self.mode == self.CREATE:
-                self.builder.processPoint(painter_pos, e.button())
+                self.builder.processPoint(painter_pos, button)
+                self._updateShapes([])
 
             elif self.mode == self.EDIT:
-                if int(e.buttons()) & Qt.LeftButton:
-                    for shape in self.shapes:
+                if int(buttons) & Qt.LeftButton:
+                    # 只有选中的形状（都在活动形状中）会被拖动
+                    shapes = self._activeShapes()
+                    for shape in shapes:
                         assert isinstance(shape, GraspRect)
                         if not shape.visible():
                             continue
                         shape.checkSelectedAndMove(painter_pos)
+                    self._updateShapes(shapes)
+                    self._checkShapesAreaChangeAndEmit(shapes)
 
-                elif int(e.buttons()) & Qt.RightButton:
-                    for shape in self.shapes:
+                elif int(buttons) & Qt.RightButton:
+                    shapes = self._activeShapes()
+                    for shape in shapes:
                         assert isinstance(shape, GraspRect)
                         if not shape.visible():
                             continue
                         shape.checkSelectedAndRotate(painter_pos)
+                    self._updateShapes(shapes)
+                    self._checkShapesAreaChangeAndEmit(shapes)
 
                 else:
-                    for shape in reversed(self.shapes):
-                        assert isinstance(shape, GraspRect)
-                        if not shape.visible():
-                            continue
-                        shape.checkPosAndHover(painter_pos, shape_only=False)
-                        if shape.hoveringAnything():
-                            self._resetHoveringExcept(shape)
-                            break
-                self._checkShapesAreaChangeAndEmit()
+                    # 指针停留不改变形状，不必检查形状区域的改变
+                    pre_hovering_shape = self._hovering_shape
+                    self._hoverAt(painter_pos)
+                    self._updateShapes([s for s in (pre_hovering_shape, self._hovering_shape) if s is not None])
 
-        self._setShapeCursorPos(painter_pos)
+        self._setShapeCursorPos(painter_pos, self._activeShapes())
         self.pre_pos = pos
-        self.update()
 
     def wheelEvent(self, e: QWheelEvent):
+        self._flushMouseMove()
         pos = e.posF()
         delta_scale = e.angleDelta().y() / 120. * 0.2
         self.pg.scaleAt(pos, delta_scale, widget_logic=True)
+        self._startFastRender()
         self.update()
 
     def keyPressEvent(self, e: QKeyEvent):
@@ -409,16 +645,17 @@ class Canvas(QWidget):
             return
 
         if e.key() == Qt.Key_Delete:
-            remove_shape_ids = [shape.id() for shape in self.shapes if shape.selected()]
+            remove_shape_ids = [shape.id() for shape in self.store.shapes if shape.selected()]
             if len(remove_shape_ids):
                 self.removeShapes(remove_shape_ids)
 
     def setMode(self, mode):
         if mode == self.CREATE:
             self.mode = self.CREATE
-            for shape in self.shapes:
+            for shape in self.store.shapes:
                 shape.resetSelected()
                 shape.resetHovering()
+            self._hovering_shape = None
 
             # 如果切换模式的时候鼠标在画布内，那么也要改变图表形状
             if self.underMouse():
@@ -431,7 +668,7 @@ class Canvas(QWidget):
                 QApplication.changeOverrideCursor(QCursor(Qt.ArrowCursor))
 
         self._checkShapesSelectionChangeAndEmit()
-        self.update()
+        self._updateShapes()
 
     def sizeHint(self):
         return QSize(1080, 720)
@@ -443,11 +680,11 @@ class Canvas(QWidget):
         options = ["fit_width", "fit_height", "fit_window", "origin_size"]
         assert fit_type.lower() in options, "fit_type support {}".format(options)
 
-        if self.pixmap is None:
+        if self.pyramid is None or self.pyramid.isNull():
             return
 
         widget_size = self.size()
-        image_size = self.pixmap.size()
+        image_size = self.pyramid.size()
 
         if fit_type.lower() == "fit_width":
             self.pg.fitWidgetWidth(widget_size, image_size)
@@ -1,3 +1,5 @@
+import bisect
+
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
@@ -5,30 +7,189 @@ from PyQt5.QtWidgets import *
 from typing import List
 
 
-class FileListItem(QStandardItem):
-    def __init__(self, filname: str):
-        super(FileListItem, self).__init__()
-        self.setCheckable(True)
-        self.setCheckState(Qt.Unchecked)  # unchecked items will not be saved in the final results
-        self.setEditable(False)
-        self.setTextAlignment(Qt.AlignBottom)
-        self.setDragEnabled(False)
-        self.setDropEnabled(False)
+class FileListModel(QAbstractListModel):
+    """
+    文件列表的 model：文件名存放在一个 list 中，是否已标注 / 是否已保存两个标志位各用一个 bytearray 存储，
+    每个文件不再对应一个 QStandardItem，百万级别的文件也可以瞬间载入。
+    """
 
-        self.setData(filname, Qt.UserRole + 1)
-        self.setData(True, Qt.UserRole + 2)  # saved state
-        self.setText(filname)
+    FileNameRole = Qt.UserRole + 1
+    SavedRole = Qt.UserRole + 2
 
-    def filename(self):
-        return self.data(Qt.UserRole + 1)
+    fileLabeledChanged = pyqtSignal(int, bool)  # int: index, bool: whether has been labeled
 
-    def savedState(self):
-        return self.data(Qt.UserRole + 2)
+    def __init__(self, parent=None):
+        super(FileListModel, self).__init__(parent)
+        self._files = list()
+        self._labeled = bytearray()
+        self._saved = bytearray()
+        self._missing = bytearray()  # 后台检查发现不存在的文件
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._files)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid() or not (0 <= index.row() < len(self._files)):
+            return None
+        row = index.row()
+
+        if role == Qt.DisplayRole:
+            return self._files[row] if self._saved[row] else "*" + self._files[row]
+        elif role == Qt.CheckStateRole:
+            # unchecked items will not be saved in the final results
+            return Qt.Checked if self._labeled[row] else Qt.Unchecked
+        elif role == Qt.TextAlignmentRole:
+            return Qt.AlignBottom
+        elif role == Qt.ForegroundRole:
+            return QColor(Qt.gray) if self._missing[row] else None
+        elif role == Qt.ToolTipRole:
+            return "File not found" if self._missing[row] else None
+        elif role == self.FileNameRole:
+            return self._files[row]
+        elif role == self.SavedRole:
+            return bool(self._saved[row])
+        return None
+
+    def setData(self, index: QModelIndex, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.CheckStateRole:
+            return False
+        self.setLabeled(index.row(), value == Qt.Checked)
+        return True
+
+    def flags(self, index: QModelIndex):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable | Qt.ItemNeverHasChildren
+
+    def setFiles(self, files: List[str], labeled: List[bool] = None):
+        self.beginResetModel()
+        self._files = list(files)
+        self._labeled = bytearray(len(self._files)) if labeled is None else bytearray(map(bool, labeled))
+        self._saved = bytearray(b"\x01") * len(self._files)
+        self._missing = bytearray(len(self._files))
+        self.endResetModel()
+
+    def appendFiles(self, files: List[str], labeled: List[bool] = None):
+        if len(files) == 0:
+            return
+        first = len(self._files)
+        self.beginInsertRows(QModelIndex(), first, first + len(files) - 1)
+        self._files.extend(files)
+        self._labeled.extend(bytearray(len(files)) if labeled is None else bytearray(map(bool, labeled)))
+        self._saved.extend(bytearray(b"\x01") * len(files))
+        self._missing.extend(bytearray(len(files)))
+        self.endInsertRows()
+
+    def mergeFiles(self, files: List[str], labeled: List[bool] = None):
+        """
+        把 files 合并到已按文件名排序的列表中，合并后仍然有序；选中状态等持久的 index 跟随文件移动。
+        只对新文件做二分查找，其余按切片整体复制，耗时基本与 files 的数量成正比。
+        """
+        if len(files) == 0:
+            return
+        order = sorted(range(len(files)), key=files.__getitem__)
+        files = [files[i] for i in order]
+        if labeled is not None:
+            labeled = [labeled[i] for i in order]
+        first = len(self._files)
+        self.appendFiles(files, labeled)
+        positions = [bisect.bisect_left(self._files, f, 0, first) for f in files]
+        if positions[0] == first:
+            return  # 全部排在最后，追加即可
+
+        self.layoutAboutToBeChanged.emit()
+        self._files, self._labeled, self._saved, self._missing = (
+            self._merged(column, first, positions) for column in (self._files, self._labeled, self._saved, self._missing)
+        )
+        old_indexes = self.persistentIndexList()
+        new_indexes = []
+        for index in old_indexes:
+            row = index.row()
+            if row < first:
+                row += bisect.bisect_right(positions, row)
+            else:
+                row = positions[row - first] + row - first
+            new_indexes.append(self.index(row))
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    @staticmethod
+    def _merged(column, first: int, positions: List[int]):
+        # column[:first] 为原有的行，column[first:] 为新行，第 j 个新行插入到原有的第 positions[j] 行之前
+        merged = column[:0]
+        prev = 0
+        for j, pos in enumerate(positions):
+            merged += column[prev:pos]
+            merged += column[first + j:first + j + 1]
+            prev = pos
+        merged += column[prev:first]
+        return merged
+
+    def removeFiles(self, rows: List[int]):
+        rows = sorted(set(rows))
+        # 连续的行合并为一次删除，从后往前删
+        ranges = []
+        for row in rows:
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        for first, last in reversed(ranges):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self._files[first:last + 1]
+            del self._labeled[first:last + 1]
+            del self._saved[first:last + 1]
+            del self._missing[first:last + 1]
+            self.endRemoveRows()
 
-    def setSavedState(self, saved=True):
-        self.setData(saved, Qt.UserRole + 2)
-        filename = self.data(Qt.UserRole + 1)
-        self.setText(("*" if not saved else "") + filename)
+    def clear(self):
+        self.setFiles([])
+
+    def fileName(self, row: int) -> str:
+        return self._files[row]
+
+    def labeled(self, row: int) -> bool:
+        return bool(self._labeled[row])
+
+    def setLabeled(self, row: int, labeled=True):
+        labeled = bool(labeled)
+        if bool(self._labeled[row]) == labeled:
+            return
+        self._labeled[row] = labeled
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+        print("[INFO] [from file_list] Emit file index = {}, has labeled = {}".format(row, labeled))
+        self.fileLabeledChanged.emit(row, labeled)
+
+    def setAllLabeled(self, labeled=True):
+        labeled = bool(labeled)
+        changed = [row for row, flag in enumerate(self._labeled) if bool(flag) != labeled]
+        if not changed:
+            return
+        self._labeled[:] = (b"\x01" if labeled else b"\x00") * len(self._labeled)
+        self.dataChanged.emit(self.index(changed[0]), self.index(changed[-1]), [Qt.CheckStateRole])
+        for row in changed:
+            self.fileLabeledChanged.emit(row, labeled)
+
+    def missing(self, row: int) -> bool:
+        return bool(self._missing[row])
+
+    def setMissing(self, rows: List[int], missing=True):
+        for row in rows:
+            self._missing[row] = missing
+        if rows:
+            self.dataChanged.emit(self.index(min(rows)), self.index(max(rows)),
+                                  [Qt.ForegroundRole, Qt.ToolTipRole])
+
+    def savedState(self, row: int) -> bool:
+        return bool(self._saved[row])
+
+    def setSavedState(self, row: int, saved=True):
+        saved = bool(saved)
+        if bool(self._saved[row]) != saved:
+            self._saved[row] = saved
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole, self.SavedRole])
 
 
 class FileListWidget(QListView):
@@ -41,18 +202,32 @@ class FileListWidget(QListView):
         self.setSelectionMode(QAbstractItemView.SingleSelection)
         self.setDragDropMode(QAbstractItemView.NoDragDrop)
 
-        item_model = QStandardItemModel(self)
-        item_model.setItemPrototype(FileListItem(""))
-        self.setModel(item_model)
+        # 每一行的高度相同，不必逐行计算 sizeHint；布局分批在事件循环中完成，载入大量文件时界面不会卡住
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(5000)
+        self.setModel(FileListModel(self))
 
         self.selectionModel().selectionChanged.connect(self._filesSelectionChangedEmit)
-        self.model().itemChanged.connect(self._fileLabeledChangedEmit)
+        self.model().fileLabeledChanged.connect(self.fileLabeledChanged)
+
+    def addFiles(self, files: List[str], labeled: List[bool] = None):
+        self.model().appendFiles(files, labeled)
+
+    def mergeFiles(self, files: List[str], labeled: List[bool] = None):
+        self.model().mergeFiles(files, labeled)
+
+    def setLabeled(self, i: int, labeled=True):
+        self.model().setLabeled(i, labeled)
+
+    def isLabeled(self, i: int) -> bool:
+        return self.model().labeled(i)
+
+    def setMissing(self, rows: List[int], missing=True):
+        self.model().setMissing(rows, missing)
 
-    def addFiles(self, files: List[str]):
-        for f in files:
-            item = FileListItem(f)
-            item.setSavedState(True)
-            self.model().appendRow(item)
+    def removeFiles(self, rows: List[int]):
+        self.model().removeFiles(rows)
 
     def clear(self):
         self.model().clear()
@@ -68,10 +243,10 @@ class FileListWidget(QListView):
               .format(selected_file_idx, deselected_file_idx))
         self.filesSelectionChanged.emit(selected_file_idx, deselected_file_idx)
 
-    def _fileLabeledChangedEmit(self, item: FileListItem):
-        print("[INFO] [from file_list] Emit file index = {}, has labeled = {}"
-              .format(item.index().row(), item.checkState() > 0))
-        self.fileLabeledChanged.emit(item.index().row(), item.checkState() > 0)
+    def selectRow(self, i: int):
+        index = self.model().index(i, 0)
+        self.selectionModel().select(index, QItemSelectionModel.ClearAndSelect)
+        self.scrollTo(index)
 
     def selectNext(self):
         if self.model().rowCount() == 0:
@@ -118,18 +293,16 @@ class FileListWidget(QListView):
         return current_select, prev_select
 
     def checkAll(self):
-        for item in self:
-            item.setCheckState(Qt.Checked)
+        self.model().setAllLabeled(True)
 
     def uncheckAll(self):
-        for item in self:
-            item.setCheckState(Qt.Unchecked)
+        self.model().setAllLabeled(False)
 
     def __len__(self):
         return self.model().rowCount()
 
-    def __getitem__(self, i) -> FileListItem:
-        return self.model().item(i)
+    def __getitem__(self, i) -> str:
+        return self.model().fileName(i)
 
     def __iter__(self):
         for i in range(len(self)):
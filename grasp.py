@@ -1,7 +1,6 @@
 import math
 import time
 import numpy as np
-import matplotlib.path
 
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
@@ -35,6 +34,11 @@ class GraspRectDispConfig(object):
     fill_hovering_alpha = 0.3
     fill_selected_alpha = 0.5
 
+    # level of detail
+    LOD_FULL, LOD_OUTLINE = 0, 1
+    lod_min_screen_size = 12  # 矩形在屏幕上小于该尺寸（像素）时不画顶点和填充
+    lod_simplify_count = 800  # 一次绘制的形状多于该数量时，所有轮廓合并为单条路径绘制
+
     # Pen
     gripper_size_pen = QPen(gripper_size_color, line_width)
     gripper_size_hovering_pen = QPen(gripper_size_hovering_color, line_hovering_width)
@@ -50,6 +54,7 @@ class GraspRectBuilder(object):
         self.points = np.zeros((4, 2), dtype=np.float)
         self.determined_num = 0
         self.grasp = GraspRect(self.points)
+        self._painted_rect = QRectF()
 
     def processPoint(self, pos: QPointF, button: Qt.MouseButton):
         assert isinstance(pos, QPointF), "Only support QPointF."
@@ -101,6 +106,13 @@ class GraspRectBuilder(object):
         self.reset()
         return grasp
 
+    def dirtyRect(self) -> QRectF:
+        # 预览矩形上一次与当前显示区域的并集（painter 坐标系）
+        rect = self.grasp.paintRect() if self.determined_num > 0 else QRectF()
+        dirty = rect.united(self._painted_rect)
+        self._painted_rect = rect
+        return dirty
+
     def paint(self, painter: QPainter):
         if self.determined_num == 0:
             return
@@ -165,6 +177,9 @@ class GraspRect(object):
             self._edges = self.computeEdgesFromPoints(self._points)  # (4, 2, 2)
             # edge: 4 lines; line: 2 points; point: 2 coordinates;
 
+        self._initStates()
+
+    def _initStates(self):
         # 可视状态
         self._visible = True
 
@@ -186,9 +201,28 @@ class GraspRect(object):
         self._visible_changed = False
         self._area_changed = False
 
+        # 显示状态（指针停留、选中、可见性、几何）是否改变，以及上一次上报的显示区域，用于局部重绘
+        self._display_changed = True
+        self._display_rect = None
+
+        # 绘制用路径的缓存，见 _renderPaths()
+        self._paths = None
+        self._paths_key = None
+
     def __repr__(self):
         return "GraspRect: id = {}, content = {}".format(self._id, self._grasp)
 
+    @classmethod
+    def fromComputed(cls, grasp: Grasp, points: np.ndarray, edges: np.ndarray, shape_id: str = None):
+        # 由 GraspBatch 批量计算好 grasp/points/edges 后直接构造，跳过逐个矩形的重复计算
+        shape = cls.__new__(cls)
+        shape._id = shape_id if shape_id is not None else "{:.7f}".format(time.perf_counter())
+        shape._grasp = grasp
+        shape._points = points
+        shape._edges = edges
+        shape._initStates()
+        return shape
+
     def copy(self, new_id=False):
         copied = GraspRect(None)
         copied.setGrasp(self.grasp())
@@ -208,6 +242,8 @@ class GraspRect(object):
             self._points = self.computePointsFromGrasp(self._grasp)
             self._edges = self.computeEdgesFromPoints(self._points)
             self._area_changed = True
+            self._display_changed = True
+            self._paths = None
 
     def setGrasp(self, grasp: Grasp):
         if self._grasp != grasp:
@@ -215,6 +251,8 @@ class GraspRect(object):
             self._points = self.computePointsFromGrasp(self._grasp)
             self._edges = self.computeEdgesFromPoints(self._points)
             self._area_changed = True
+            self._display_changed = True
+            self._paths = None
 
     def points(self):
         return self._points.copy()
@@ -222,6 +260,12 @@ class GraspRect(object):
     def edges(self):
         return self._edges.copy()
 
+    def boundingBox(self):
+        # (x0, y0, x1, y1)
+        x0, y0 = self._points.min(axis=0)
+        x1, y1 = self._points.max(axis=0)
+        return float(x0), float(y0), float(x1), float(y1)
+
     def visible(self):
         return self._visible
 
@@ -231,6 +275,7 @@ class GraspRect(object):
             # if not self._visible:
             #     self.resetSelected()
             self._visible_changed = True
+            self._display_changed = True
 
     def selected(self):
         # 只选中区域本身
@@ -240,6 +285,7 @@ class GraspRect(object):
         if self._selected != select:
             self._selected = select
             self._selected_changed = True
+            self._display_changed = True
 
     def selectedAnything(self):
         # 区域、边、点
@@ -247,10 +293,16 @@ class GraspRect(object):
                or (self._selected_point_idx is not None) \
                or (self._selected_edge_idx is not None)
 
+    def setSelectedPart(self, select=True, point_idx=None, edge_idx=None):
+        # 选中整个区域，同时记录被选中的点或边（用于拖动）
+        if (self._selected_point_idx != point_idx) or (self._selected_edge_idx != edge_idx):
+            self._selected_point_idx = point_idx
+            self._selected_edge_idx = edge_idx
+            self._display_changed = True
+        self.setSelected(select)
+
     def resetSelected(self):
-        self._selected_point_idx = None
-        self._selected_edge_idx = None
-        self.setSelected(False)
+        self.setSelectedPart(False)
 
     def hovering(self):
         return self._hovering
@@ -260,10 +312,16 @@ class GraspRect(object):
                or (self._hovering_point_idx is not None) \
                or (self._hovering_edge_idx is not None)
 
+    def setHoveringPart(self, hovering=True, point_idx=None, edge_idx=None):
+        if (self._hovering != hovering) or (self._hovering_point_idx != point_idx) \
+                or (self._hovering_edge_idx != edge_idx):
+            self._hovering_point_idx = point_idx
+            self._hovering_edge_idx = edge_idx
+            self._hovering = hovering
+            self._display_changed = True
+
     def resetHovering(self):
-        self._hovering_point_idx = None
-        self._hovering_edge_idx = None
-        self._hovering = False
+        self.setHoveringPart(False)
 
     def setCursorPos(self, pos: QPointF):
         self._pre_cursor_pos = pos
@@ -291,6 +349,27 @@ class GraspRect(object):
         self._visible_changed = False
         self._area_changed = False
 
+    def displayChanged(self):
+        return self._display_changed
+
+    @classmethod
+    def paintPadding(cls):
+        # 顶点标记和最粗的线宽超出矩形本身的距离（painter 坐标系）
+        return GraspRectDispConfig.point_size / 2. + GraspRectDispConfig.line_selected_width
+
+    def paintRect(self) -> QRectF:
+        x0, y0, x1, y1 = self.boundingBox()
+        pad = self.paintPadding()
+        return QRectF(x0 - pad, y0 - pad, x1 - x0 + 2 * pad, y1 - y0 + 2 * pad)
+
+    def takeDirtyRect(self) -> QRectF:
+        """返回上一次上报的显示区域与当前显示区域的并集，并清除显示状态改变标记"""
+        rect = self.paintRect() if self._visible else QRectF()
+        dirty = rect if self._display_rect is None else rect.united(self._display_rect)
+        self._display_rect = rect
+        self._display_changed = False
+        return dirty
+
     @classmethod
     def computeGraspFromPoints(cls, points) -> Grasp:
         center = points.mean(axis=0)
@@ -334,15 +413,16 @@ class GraspRect(object):
         return idx, dists[idx]
 
     def getNearestEdge(self, pos: QPointF):
-        out_point = np.array([pos.x(), pos.y()], dtype=np.float)
-        dists = [utils.dist_from_line_to_point(line[0], line[1], out_point)
-                 for line in self._edges]
+        dists = GraspBatch.distFromEdgesToPoint(self._edges, pos.x(), pos.y())
         idx = np.argmin(dists)
         return idx, dists[idx]
 
     def containsPoint(self, pos: QPointF):
-        polygon = matplotlib.path.Path(self._points)
-        return polygon.contains_point((pos.x(), pos.y()))
+        # 将点转换到矩形的局部坐标系（gripper_open 方向、gripper_size 方向）后解析判断
+        dx, dy = pos.x() - self._grasp.center[0], pos.y() - self._grasp.center[1]
+        cos_a, sin_a = math.cos(self._grasp.angle), math.sin(self._grasp.angle)
+        return abs(dx * cos_a + dy * sin_a) <= self._grasp.gripper_open / 2. \
+            and abs(-dx * sin_a + dy * cos_a) <= self._grasp.gripper_size / 2.
 
     def checkPos(self, pos: QPointF):
         # 根据鼠标点的坐标判断是否在矩形内、矩形周围、某个点周围、某条线周围。
@@ -367,28 +447,20 @@ class GraspRect(object):
             return
 
         if shape_only:
-            self._selected_point_idx = None
-            self._selected_edge_idx = None
-            self.setSelected(self.containsPoint(pos))
+            self.setSelectedPart(self.containsPoint(pos))
         else:
             in_shape, near_shape, point_idx, edge_idx = self.checkPos(pos)
-            self._selected_point_idx = point_idx
-            self._selected_edge_idx = edge_idx
-            self.setSelected(near_shape)
+            self.setSelectedPart(near_shape, point_idx, edge_idx)
 
     def checkPosAndHover(self, pos: QPointF, shape_only=True):
         if not self._visible:
             return
 
         if shape_only:
-            self._hovering_point_idx = None
-            self._hovering_edge_idx = None
-            self._hovering = self.containsPoint(pos)
+            self.setHoveringPart(self.containsPoint(pos))
         else:
             in_shape, near_shape, point_idx, edge_idx = self.checkPos(pos)
-            self._hovering_point_idx = point_idx
-            self._hovering_edge_idx = edge_idx
-            self._hovering = near_shape
+            self.setHoveringPart(near_shape, point_idx, edge_idx)
 
     def checkSelectedAndMove(self, pos: QPointF):
         if self._selected_point_idx is not None:
@@ -490,9 +562,11 @@ class GraspRect(object):
         fill_color = QColor.fromHslF(hue / 360., 1., 0.5, alpha)
         return fill_color
 
-    def paint(self, painter: QPainter):
-        if not self._visible:
-            return
+    def _renderPaths(self):
+        # 缓存的绘制用路径：几何改变时由 setPoints() / setGrasp() 清除，顶点的高亮下标改变时重新构建
+        key = (self._hovering_point_idx, self._selected_point_idx)
+        if (self._paths is not None) and (self._paths_key == key):
+            return self._paths
 
         line_path = QPainterPath()
         vrtx_path = QPainterPath()
@@ -515,6 +589,30 @@ class GraspRect(object):
                                      self._points[i, 1] - GraspRectDispConfig.point_size / 2.,
                                      GraspRectDispConfig.point_size, GraspRectDispConfig.point_size)
 
+        edge_paths = []
+        for edge in self._edges:
+            single_edge_path = QPainterPath()
+            single_edge_path.moveTo(edge[0, 0], edge[0, 1])
+            single_edge_path.lineTo(edge[1, 0], edge[1, 1])
+            edge_paths.append(single_edge_path)
+
+        self._paths = (line_path, vrtx_path, edge_paths)
+        self._paths_key = key
+        return self._paths
+
+    def paint(self, painter: QPainter, lod=GraspRectDispConfig.LOD_FULL):
+        if not self._visible:
+            return
+
+        line_path, vrtx_path, edge_paths = self._renderPaths()
+
+        if lod == GraspRectDispConfig.LOD_OUTLINE:
+            for i in range(4):
+                painter.setPen(GraspRectDispConfig.gripper_size_pen if i % 2 == 0
+                               else GraspRectDispConfig.gripper_open_pen)
+                painter.drawPath(edge_paths[i])
+            return
+
         # First fill the rect
         fill_color = self.getFillColor()
         painter.fillPath(line_path, fill_color)
@@ -529,12 +627,8 @@ class GraspRect(object):
                 pen = GraspRectDispConfig.gripper_open_selected_pen if i == self._selected_edge_idx \
                     else (GraspRectDispConfig.gripper_open_hovering_pen if i == self._hovering_edge_idx
                           else GraspRectDispConfig.gripper_open_pen)
-            edge = self._edges[i]
             painter.setPen(pen)
-            single_edge_path = QPainterPath()
-            single_edge_path.moveTo(edge[0, 0], edge[0, 1])
-            single_edge_path.lineTo(edge[1, 0], edge[1, 1])
-            painter.drawPath(single_edge_path)
+            painter.drawPath(edge_paths[i])
 
         # Finally draw points
         highlight_point_color = (self._hovering_point_idx is not None) or (self._selected_point_idx is not None)
@@ -542,6 +636,22 @@ class GraspRect(object):
             else GraspRectDispConfig.point_color
         painter.fillPath(vrtx_path, point_color)
 
+    @classmethod
+    def paintOutlines(cls, painter: QPainter, edges: np.ndarray):
+        """
+        简化绘制：所有形状的轮廓合并为两条路径（gripper_size 边和 gripper_open 边）一次画完，
+        不画填充和顶点。edges: (N, 4, 2, 2)
+        """
+        size_path, open_path = QPainterPath(), QPainterPath()
+        for shape_edges in edges.tolist():
+            for i, ((x0, y0), (x1, y1)) in enumerate(shape_edges):
+                path = size_path if i % 2 == 0 else open_path
+                path.moveTo(x0, y0)
+                path.lineTo(x1, y1)
+
+        painter.strokePath(size_path, GraspRectDispConfig.gripper_size_pen)
+        painter.strokePath(open_path, GraspRectDispConfig.gripper_open_pen)
+
     def export(self):
         points = self.points()
         grasp = self.grasp()
@@ -554,3 +664,256 @@ class GraspRect(object):
             "gripper_open": float(grasp.gripper_open),
             "angle": float(grasp.angle)
         }
+
+
+class GraspBatch(object):
+    """
+    列存储（structure-of-arrays）的一组 grasp，所有几何计算对 N 个矩形一次性向量化完成：
+        centers: (N, 2)
+        sizes:   (N,)   gripper_size
+        opens:   (N,)   gripper_open
+        angles:  (N,)
+        ids:     list of str or None
+    """
+
+    def __init__(self, centers=None, sizes=None, opens=None, angles=None, ids=None):
+        self.centers = np.zeros((0, 2)) if centers is None \
+            else np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        n = len(self.centers)
+        self.sizes = np.zeros(n) if sizes is None else np.asarray(sizes, dtype=np.float64).reshape(n)
+        self.opens = np.zeros(n) if opens is None else np.asarray(opens, dtype=np.float64).reshape(n)
+        self.angles = np.zeros(n) if angles is None else np.asarray(angles, dtype=np.float64).reshape(n)
+        self.ids = None if ids is None else list(ids)
+
+    def __len__(self):
+        return len(self.centers)
+
+    def __repr__(self):
+        return "GraspBatch: size = {}".format(len(self))
+
+    @classmethod
+    def fromShapes(cls, shapes: list):
+        grasps = [shape._grasp for shape in shapes]
+        return cls(
+            centers=[g.center for g in grasps],
+            sizes=[g.gripper_size for g in grasps],
+            opens=[g.gripper_open for g in grasps],
+            angles=[g.angle for g in grasps],
+            ids=[shape.id() for shape in shapes]
+        )
+
+    @classmethod
+    def fromPoints(cls, points: np.ndarray, ids=None):
+        centers, sizes, opens, angles = cls.computeGraspsFromPoints(points)
+        return cls(centers, sizes, opens, angles, ids)
+
+    @classmethod
+    def fromDicts(cls, shapes: list):
+        # shapes: list[dict], 与 GraspRect.export() 的格式相同，只使用 "points"
+        points = np.array([shape["points"] for shape in shapes], dtype=np.float64).reshape(-1, 4, 2)
+        return cls.fromPoints(points)
+
+    @classmethod
+    def fromExported(cls, shapes: list):
+        """
+        shapes: list[dict], GraspRect.export() 的格式。有 grasp 参数（center, gripper_size, gripper_open, angle）时
+        直接使用参数和 id，points 由参数重新计算；由 points 反算的参数在 gripper_open > gripper_size 时角度会相差 pi。
+        只有 points 的记录用 fromDicts()
+        """
+        if not all("center" in shape for shape in shapes):
+            return cls.fromDicts(shapes)
+        return cls(
+            centers=[shape["center"] for shape in shapes],
+            sizes=[shape["gripper_size"] for shape in shapes],
+            opens=[shape["gripper_open"] for shape in shapes],
+            angles=[shape["angle"] for shape in shapes],
+            ids=[shape.get("id") for shape in shapes]
+        )
+
+    def grasp(self, i) -> Grasp:
+        return Grasp(self.centers[i].copy(), float(self.sizes[i]), float(self.opens[i]), float(self.angles[i]))
+
+    def points(self):
+        return self.computePointsFromGrasps(self.centers, self.sizes, self.opens, self.angles)
+
+    def edges(self):
+        return self.computeEdgesFromPoints(self.points())
+
+    def toShapes(self):
+        points = self.points()
+        edges = self.computeEdgesFromPoints(points)
+        ids = self.ids if self.ids is not None else [None] * len(self)
+        return [GraspRect.fromComputed(self.grasp(i), points[i], edges[i], ids[i])
+                for i in range(len(self))]
+
+    def export(self):
+        ids = self.ids if self.ids is not None \
+            else ["{:.7f}".format(time.perf_counter()) for _ in range(len(self))]
+        return [
+            {
+                "id": shape_id,
+                "points": points,
+                "center": center,
+                "gripper_size": gripper_size,
+                "gripper_open": gripper_open,
+                "angle": angle
+            }
+            for shape_id, points, center, gripper_size, gripper_open, angle in zip(
+                ids, self.points().tolist(), self.centers.tolist(),
+                self.sizes.tolist(), self.opens.tolist(), self.angles.tolist()
+            )
+        ]
+
+    @classmethod
+    def computeGraspsFromPoints(cls, points: np.ndarray):
+        """points: (N, 4, 2)，与 GraspRect.computeGraspFromPoints() 逐个计算的结果一致"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 4, 2)
+        centers = points.mean(axis=1)
+        d01 = points[:, 0] - points[:, 1]
+        d12 = points[:, 1] - points[:, 2]
+        sizes = np.hypot(d01[:, 0], d01[:, 1])
+        opens = np.hypot(d12[:, 0], d12[:, 1])
+
+        angles = np.where(
+            opens > sizes,
+            np.arctan2(d12[:, 1], d12[:, 0]),
+            utils.norm_angles(np.arctan2(d01[:, 1], d01[:, 0]) + math.pi / 2.)
+        )
+        return centers, sizes, opens, angles
+
+    @classmethod
+    def computePointsFromGrasps(cls, centers, sizes, opens, angles):
+        """返回 (N, 4, 2)，与 GraspRect.computePointsFromGrasp() 逐个计算的结果一致"""
+        cos_a, sin_a = np.cos(angles), np.sin(angles)
+        cos_b, sin_b = np.cos(angles + math.pi / 2.), np.sin(angles + math.pi / 2.)
+
+        vec_ul = np.stack((opens / 2. * cos_a + sizes / 2. * cos_b,
+                           opens / 2. * sin_a + sizes / 2. * sin_b), axis=-1)
+        vec_ur = np.stack((opens / 2. * cos_a - sizes / 2. * cos_b,
+                           opens / 2. * sin_a - sizes / 2. * sin_b), axis=-1)
+
+        return np.stack((centers - vec_ur, centers - vec_ul,
+                         centers + vec_ur, centers + vec_ul), axis=1)
+
+    @classmethod
+    def computeEdgesFromPoints(cls, points: np.ndarray):
+        """points: (N, 4, 2) -> edges: (N, 4, 2, 2)"""
+        return np.stack((points, points[:, [1, 2, 3, 0]]), axis=2)
+
+    @classmethod
+    def computeBoundingBoxes(cls, points: np.ndarray):
+        """points: (N, 4, 2) -> (N, 4)，每行为 (x0, y0, x1, y1)"""
+        return np.concatenate((points.min(axis=1), points.max(axis=1)), axis=1)
+
+    @classmethod
+    def containsPoint(cls, centers, sizes, opens, angles, x, y):
+        """解析判断点 (x, y) 是否在每个旋转矩形内，返回 (N,) bool"""
+        dx, dy = x - centers[:, 0], y - centers[:, 1]
+        cos_a, sin_a = np.cos(angles), np.sin(angles)
+        return (np.abs(dx * cos_a + dy * sin_a) <= opens / 2.) \
+            & (np.abs(-dx * sin_a + dy * cos_a) <= sizes / 2.)
+
+    @classmethod
+    def distFromVertexesToPoint(cls, points: np.ndarray, x, y):
+        """points: (N, 4, 2) -> (N, 4)"""
+        return np.hypot(points[..., 0] - x, points[..., 1] - y)
+
+    @classmethod
+    def distFromEdgesToPoint(cls, edges: np.ndarray, x, y):
+        """edges: (N, 4, 2, 2) -> (N, 4)，点到线段的距离，与 utils.dist_from_line_to_point() 一致"""
+        p0, p1 = edges[..., 0, :], edges[..., 1, :]
+        vec01 = p1 - p0
+        vec0x = np.stack((x - p0[..., 0], y - p0[..., 1]), axis=-1)
+        norm2 = np.maximum((vec01 ** 2).sum(axis=-1), 1e-12)
+        t = np.clip((vec01 * vec0x).sum(axis=-1) / norm2, 0., 1.)
+        vec = vec0x - t[..., None] * vec01
+        return np.hypot(vec[..., 0], vec[..., 1])
+
+
+class GraspHitTester(object):
+    """
+    对 canvas 上的所有形状做一次向量化的命中测试，回答“鼠标下最上层的形状 / 点 / 边”。
+    判断规则与 GraspRect.checkPos() 相同：点 > 边，矩形内、点附近、边附近任一满足即为命中；
+    下标越大的形状越靠上。几何数据按形状下标缓存，形状增删、排序、可见性改变后需要 invalidate()。
+    """
+
+    edge_select_tolerance = GraspRect.edge_select_tolerance
+    vertex_select_tolerance = GraspRect.vertex_select_tolerance
+
+    def __init__(self):
+        self._batch = None
+        self._points = None
+        self._edges = None
+        self._visible = None
+
+    def invalidate(self):
+        self._batch = None
+
+    def sync(self, shapes: list):
+        if self._batch is not None and len(self._batch) == len(shapes):
+            return
+        self._batch = GraspBatch.fromShapes(shapes)
+        self._points = np.array([shape._points for shape in shapes], dtype=np.float64).reshape(-1, 4, 2)
+        self._edges = GraspBatch.computeEdgesFromPoints(self._points)
+        self._visible = np.array([shape.visible() for shape in shapes], dtype=bool)
+
+    def edges(self, indexes):
+        return self._edges[indexes]
+
+    def extents(self, indexes):
+        # 每个矩形较长的一边（painter 坐标系）
+        return np.maximum(self._batch.sizes[indexes], self._batch.opens[indexes])
+
+    def updateShapes(self, indexes: list, shapes: list):
+        # 只更新几何发生变化的形状（例如拖动中的那一个）
+        if self._batch is None:
+            return
+        for i in indexes:
+            grasp = shapes[i]._grasp
+            self._batch.centers[i] = grasp.center
+            self._batch.sizes[i] = grasp.gripper_size
+            self._batch.opens[i] = grasp.gripper_open
+            self._batch.angles[i] = grasp.angle
+            self._points[i] = shapes[i]._points
+            self._edges[i] = shapes[i]._edges
+
+    def hitTest(self, shapes: list, pos: QPointF, shape_only=False, candidates=None):
+        """
+        :param shapes: canvas 的形状列表
+        :param pos: painter 坐标系下的点
+        :param shape_only: 只判断是否在矩形内
+        :param candidates: 只测试这些下标的形状（例如空间索引查询的结果），None 表示全部
+        :return: (shape_idx, point_idx, edge_idx)，没有命中时 shape_idx 为 None
+        """
+        self.sync(shapes)
+
+        if candidates is None:
+            idx = np.flatnonzero(self._visible)
+        else:
+            idx = np.unique(np.asarray(candidates, dtype=np.int64))
+            idx = idx[self._visible[idx]]
+        if len(idx) == 0:
+            return None, None, None
+
+        x, y = pos.x(), pos.y()
+        b = self._batch
+        hits = GraspBatch.containsPoint(b.centers[idx], b.sizes[idx], b.opens[idx], b.angles[idx], x, y)
+        if shape_only:
+            hit = np.flatnonzero(hits)
+            return (int(idx[hit[-1]]), None, None) if len(hit) else (None, None, None)
+
+        vertex_dists = GraspBatch.distFromVertexesToPoint(self._points[idx], x, y)
+        vertex_idx = vertex_dists.argmin(axis=1)
+        near_vertex = vertex_dists.min(axis=1) < self.vertex_select_tolerance
+
+        edge_dists = GraspBatch.distFromEdgesToPoint(self._edges[idx], x, y)
+        edge_idx = edge_dists.argmin(axis=1)
+        near_edge = ~near_vertex & (edge_dists.min(axis=1) < self.edge_select_tolerance)
+
+        hit = np.flatnonzero(hits | near_vertex | near_edge)
+        if len(hit) == 0:
+            return None, None, None
+        k = hit[-1]
+        point_idx = int(vertex_idx[k]) if near_vertex[k] else None
+        edge_idx = int(edge_idx[k]) if near_edge[k] else None
+        return int(idx[k]), point_idx, edge_idx
@@ -0,0 +1,125 @@
+from PyQt5.QtGui import *
+from PyQt5.QtCore import *
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+
+def read_scaled_image(path: str, max_size: QSize = None) -> QImage:
+    """解码图片，图片大于 max_size 时直接按缩小后的尺寸解码（JPEG 等格式解码器原生支持，速度快得多）"""
+    reader = QImageReader(path)
+    size = reader.size()
+    if max_size is not None and size.isValid() and \
+            (size.width() > max_size.width() or size.height() > max_size.height()):
+        reader.setScaledSize(size.scaled(max_size, Qt.KeepAspectRatio))
+    return reader.read()
+
+
+class ImageCache(object):
+    """
+    已解码图片（QImage）的 LRU 缓存，按占用的字节数而不是图片张数淘汰。
+    只在 GUI 线程中访问。
+    """
+
+    DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()  # path -> QImage, 最近使用的在最后
+        self._bytes = 0
+
+    def get(self, path: str):
+        image = self._images.get(path)
+        if image is not None:
+            self._images.move_to_end(path)
+        return image
+
+    def put(self, path: str, image: QImage):
+        if image.isNull():
+            return
+        if path in self._images:
+            self._bytes -= self._images.pop(path).sizeInBytes()
+        self._images[path] = image
+        self._bytes += image.sizeInBytes()
+        # 至少保留刚放入的这一张
+        while self._bytes > self.max_bytes and len(self._images) > 1:
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= evicted.sizeInBytes()
+
+    def clear(self):
+        self._images.clear()
+        self._bytes = 0
+
+    def nbytes(self):
+        return self._bytes
+
+    def __contains__(self, path):
+        return path in self._images
+
+    def __len__(self):
+        return len(self._images)
+
+
+class ImagePrefetcher(QObject):
+    """
+    在工作线程中预先解码当前图片前后若干张，结果放入 ImageCache，切换图片时直接从缓存取出。
+    QPixmap 只能在 GUI 线程中使用，因此工作线程只解码为 QImage。
+    """
+
+    imageLoaded = pyqtSignal(str)  # path
+
+    _decoded = pyqtSignal(str, QImage)  # 由工作线程发出，排队到 GUI 线程中处理
+
+    MAX_WORKERS = 2
+
+    def __init__(self, cache: ImageCache, parent=None):
+        super(ImagePrefetcher, self).__init__(parent)
+        self.cache = cache
+        self.decode_size = None  # QSize, 按此大小缩小解码，None 时解码原图
+        self._pool = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+        self._pending = dict()  # path -> Future
+        self._decoded.connect(self._store)
+
+    def setDecodeSize(self, size: QSize):
+        self.decode_size = QSize(size)
+
+    def _decode(self, path: str):
+        image = read_scaled_image(path, self.decode_size)
+        self._decoded.emit(path, image)
+        return image
+
+    def _store(self, path: str, image: QImage):
+        self._pending.pop(path, None)
+        if not image.isNull():
+            self.cache.put(path, image)
+            self.imageLoaded.emit(path)
+
+    def prefetch(self, paths: List[str]):
+        """按顺序预取 paths 中尚未缓存的图片，取消不再需要的预取任务"""
+        wanted = set(paths)
+        for path in list(self._pending):
+            if path not in wanted and self._pending[path].cancel():
+                del self._pending[path]
+        for path in paths:
+            if path not in self.cache and path not in self._pending:
+                self._pending[path] = self._pool.submit(self._decode, path)
+
+    def load(self, path: str) -> QImage:
+        """取出图片，未缓存时在当前线程中同步解码"""
+        image = self.cache.get(path)
+        if image is None:
+            future = self._pending.pop(path, None)
+            if future is not None and not future.cancel():
+                image = future.result()  # 正在解码，等待其完成即可
+            else:
+                image = read_scaled_image(path, self.decode_size)
+            self.cache.put(path, image)
+        return image
+
+    def shutdown(self):
+        # 逐个取消还没有开始的任务（shutdown 的 cancel_futures 参数需要 Python 3.9）
+        for future in self._pending.values():
+            future.cancel()
+        self._pool.shutdown(wait=False)
+        self._pending.clear()
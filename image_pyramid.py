@@ -0,0 +1,171 @@
+import math
+import threading
+
+from PyQt5.QtGui import *
+from PyQt5.QtCore import *
+
+from concurrent.futures import ThreadPoolExecutor
+
+from image_cache import ImageCache
+
+
+class ImagePyramid(QObject):
+    """
+    分块的多分辨率图片。
+    overview 为整幅图片的缩略图（通常按窗口大小解码），缩放到 overview 分辨率不够时，
+    按当前缩放比例选择金字塔层级（第 L 层为原图的 1 / 2^L），只解码、绘制可见的图块。
+    图块在工作线程中解码，解码完成前先用放大的 overview 代替。
+    一般先在后台解码一次整幅原图再从中切出图块；像素数超过 FULL_DECODE_PIXELS 且格式支持 ClipRect（如 JPEG）时，
+    不再解码整幅原图，而是直接从文件中按区域解码图块，以控制内存占用。
+    """
+
+    tileLoaded = pyqtSignal(QRectF)  # 图片坐标系下新解码完成的区域
+
+    _tileDecoded = pyqtSignal(object, QImage)  # 由工作线程发出，排队到 GUI 线程中处理
+
+    TILE_SIZE = 512
+    TILE_CACHE_BYTES = 256 * 1024 * 1024
+    MAX_WORKERS = 2
+    FULL_DECODE_PIXELS = 64 * 1024 * 1024
+
+    def __init__(self, overview: QImage, path: str = None, parent=None):
+        super(ImagePyramid, self).__init__(parent)
+        self.path = path
+        self.overview = overview
+        self._overview_pixmap = QPixmap.fromImage(overview) if not overview.isNull() else QPixmap()
+
+        reader = QImageReader(path) if path is not None else None
+        self._size = reader.size() if (reader is not None and reader.size().isValid()) else overview.size()
+        self._clip_decode = reader is not None and reader.supportsOption(QImageIOHandler.ClipRect) and \
+            self._size.width() * self._size.height() > self.FULL_DECODE_PIXELS
+        # 没有文件路径，或者 overview 就是原图时，图块直接从 overview 中切出
+        self._full = overview if (path is None or overview.size() == self._size) else None
+        self._full_lock = threading.Lock()
+
+        self._tiles = ImageCache(self.TILE_CACHE_BYTES)  # (level, tx, ty) -> QImage
+        self._pending = dict()  # (level, tx, ty) -> Future
+        self._pool = None
+        self._tileDecoded.connect(self._storeTile)
+
+    def size(self) -> QSize:
+        return self._size
+
+    def isNull(self):
+        return self._overview_pixmap.isNull()
+
+    def overviewScale(self):
+        return self.overview.width() / max(self._size.width(), 1)
+
+    # ---------------- tiles ----------------
+
+    def _levelFor(self, device_scale: float):
+        # 选择分辨率不低于屏幕分辨率的最粗糙层级
+        if device_scale >= 1.:
+            return 0
+        return int(math.floor(math.log2(1. / device_scale)))
+
+    def _tileSourceRect(self, key) -> QRect:
+        # 图块在原图坐标系下的区域
+        level, tx, ty = key
+        span = self.TILE_SIZE << level
+        return QRect(tx * span, ty * span, span, span).intersected(QRect(QPoint(0, 0), self._size))
+
+    def _tileSize(self, key) -> QSize:
+        level = key[0]
+        src = self._tileSourceRect(key)
+        return QSize(max(1, int(math.ceil(src.width() / (1 << level)))),
+                     max(1, int(math.ceil(src.height() / (1 << level)))))
+
+    def _fullImage(self):
+        with self._full_lock:
+            if self._full is None:
+                self._full = QImage(self.path)
+            return self._full
+
+    def _decodeTiles(self, keys):
+        # 同一行中相邻的图块一次解码：JPEG 按 ClipRect 解码时需要从头逐行解码到目标区域，合并后只需解码一次
+        level = keys[0][0]
+        src = QRect()
+        for key in keys:
+            src = src.united(self._tileSourceRect(key))
+        size = QSize(int(math.ceil(src.width() / (1 << level))), int(math.ceil(src.height() / (1 << level))))
+
+        if self._full is None and self._clip_decode:
+            reader = QImageReader(self.path)
+            reader.setClipRect(src)
+            reader.setScaledSize(size)
+            strip = reader.read()
+        else:
+            strip = self._fullImage().copy(src)
+            if strip.size() != size:
+                strip = strip.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+        for key in keys:
+            x = (self._tileSourceRect(key).left() - src.left()) >> level
+            self._tileDecoded.emit(key, strip.copy(QRect(QPoint(x, 0), self._tileSize(key))))
+
+    def _storeTile(self, key, tile: QImage):
+        if self._pending.pop(key, None) is None:
+            return  # 已被取消
+        if not tile.isNull():
+            self._tiles.put(key, tile)
+            self.tileLoaded.emit(QRectF(self._tileSourceRect(key)))
+
+    def _requestTiles(self, level, keys):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+        # 缩放到其他层级后，之前层级尚未开始解码的图块不再需要
+        for key in list(self._pending):
+            if key[0] != level and self._pending[key].cancel():
+                del self._pending[key]
+        rows = dict()  # ty -> list of key
+        for key in keys:
+            if key not in self._pending:
+                rows.setdefault(key[2], []).append(key)
+        for row in rows.values():
+            future = self._pool.submit(self._decodeTiles, row)
+            for key in row:
+                self._pending[key] = future
+
+    # ---------------- paint ----------------
+
+    def paint(self, painter: QPainter, exposed: QRectF, device_scale: float):
+        """
+        :param exposed: 需要绘制的区域，图片坐标系
+        :param device_scale: 每个图片像素对应的设备像素数
+        """
+        if self.isNull():
+            return
+        bounds = QRectF(0, 0, self._size.width(), self._size.height())
+        exposed = exposed.intersected(bounds)
+        if exposed.isEmpty():
+            return
+
+        painter.drawPixmap(bounds, self._overview_pixmap, QRectF(self._overview_pixmap.rect()))
+
+        if self.overviewScale() >= device_scale * 0.95:
+            return  # overview 的分辨率已经足够（例如适应窗口时）
+        level = self._levelFor(device_scale)
+
+        span = self.TILE_SIZE << level
+        tx0, ty0 = int(exposed.left() // span), int(exposed.top() // span)
+        tx1, ty1 = int(math.ceil(exposed.right() / span)), int(math.ceil(exposed.bottom() / span))
+        missing = []
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                key = (level, tx, ty)
+                tile = self._tiles.get(key)
+                if tile is None:
+                    missing.append(key)
+                else:
+                    painter.drawImage(QRectF(self._tileSourceRect(key)), tile, QRectF(tile.rect()))
+        if missing:
+            self._requestTiles(level, missing)
+
+    def close(self):
+        if self._pool is not None:
+            # 逐个取消还没有开始的解码（shutdown 的 cancel_futures 参数需要 Python 3.9），同一行的图块共用一个任务
+            for future in set(self._pending.values()):
+                future.cancel()
+            self._pool.shutdown(wait=False)
+        self._pending.clear()
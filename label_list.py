@@ -7,20 +7,43 @@ from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
 
 from grasp import GraspRect
+from shape_store import ShapeStore
 
 
-class HTMLDelegate(QStyledItemDelegate):
+class ShapeItemDelegate(QStyledItemDelegate):
+    """
+    形状列表的行绘制：文字为形状 id，后面跟一个形状颜色的圆点。
+    原先每次绘制都要 QTextDocument.setHtml() 重新解析 HTML，现在改为纯文本，
+    并按 (文字, 颜色, 是否选中, 字体) 缓存排好版的 QStaticText，滚动和切换选中时直接复用。
+    """
+
+    BULLET = " \u25cf"
+    CACHE_LIMIT = 4096
+
     def __init__(self, parent=None):
-        super(HTMLDelegate, self).__init__()
-        self.doc = QTextDocument(self)
+        super(ShapeItemDelegate, self).__init__(parent)
+        self._cache = dict()  # (text, rgba, selected, font key) -> (QStaticText, QStaticText)
+
+    def _staticTexts(self, text: str, color: QColor, selected: bool, font: QFont):
+        key = (text, color.rgba(), selected, font.key())
+        texts = self._cache.get(key)
+        if texts is None:
+            if len(self._cache) >= self.CACHE_LIMIT:
+                self._cache.clear()
+            label, bullet = QStaticText(text), QStaticText(self.BULLET)
+            for static_text in (label, bullet):
+                static_text.setTextFormat(Qt.PlainText)
+                static_text.setPerformanceHint(QStaticText.AggressiveCaching)
+                static_text.prepare(QTransform(), font)
+            texts = self._cache[key] = (label, bullet)
+        return texts
 
     def paint(self, painter, option, index):
         painter.save()
 
         options = QStyleOptionViewItem(option)
-
         self.initStyleOption(options, index)
-        self.doc.setHtml(options.text)
+        text = options.text
         options.text = ""
 
         style = (
@@ -30,209 +53,113 @@ class HTMLDelegate(QStyledItemDelegate):
         )
         style.drawControl(QStyle.CE_ItemViewItem, options, painter)
 
-        ctx = QAbstractTextDocumentLayout.PaintContext()
-
-        if option.state & QStyle.State_Selected:
-            ctx.palette.setColor(
-                QPalette.Text,
-                option.palette.color(
-                    QPalette.Active, QPalette.HighlightedText
-                ),
-            )
-        else:
-            ctx.palette.setColor(
-                QPalette.Text,
-                option.palette.color(QPalette.Active, QPalette.Text),
-            )
+        selected = bool(option.state & QStyle.State_Selected)
+        color = index.data(ShapeStore.ColorRole)
+        color = QColor(color) if color is not None else option.palette.color(QPalette.Active, QPalette.Text)
+        label, bullet = self._staticTexts(text, color, selected, options.font)
 
         textRect = style.subElementRect(QStyle.SE_ItemViewItemText, options)
-
         if index.column() != 0:
             textRect.adjust(5, 0, 0, 0)
+        top = textRect.top() + (textRect.height() - options.fontMetrics.height()) // 2
 
-        thefuckyourshitup_constant = 4
-        margin = (option.rect.height() - options.fontMetrics.height()) // 2
-        margin = margin - thefuckyourshitup_constant
-        textRect.setTop(textRect.top() + margin)
-
-        painter.translate(textRect.topLeft())
-        painter.setClipRect(textRect.translated(-textRect.topLeft()))
-        self.doc.documentLayout().draw(painter, ctx)
+        painter.setClipRect(textRect)
+        painter.setFont(options.font)
+        painter.setPen(option.palette.color(
+            QPalette.Active, QPalette.HighlightedText if selected else QPalette.Text
+        ))
+        painter.drawStaticText(QPointF(textRect.left(), top), label)
+        painter.setPen(color)
+        painter.drawStaticText(QPointF(textRect.left() + label.size().width(), top), bullet)
 
         painter.restore()
 
     def sizeHint(self, option, index):
-        thefuckyourshitup_constant = 4
-        return QSize(
-            self.doc.idealWidth(),
-            self.doc.size().height() - thefuckyourshitup_constant,
-        )
-
-
-class LabelListWidgetItem(QStandardItem):
-    def __init__(self, shape: GraspRect = None):
-        super(LabelListWidgetItem, self).__init__()
-        self.setCheckable(True)
-        self.setCheckState(Qt.Checked)
-        self.setEditable(False)
-        self.setTextAlignment(Qt.AlignBottom)
-        self.setDragEnabled(True)
-        self.setDropEnabled(False)
-
-        self.setShape(shape)
-        self.updateText()
-
-    def setShape(self, shape: GraspRect):
-        self.setData(shape, Qt.UserRole + 1)
-
-    def updateText(self):
-        data = self.shape()
-        if not isinstance(data, GraspRect):
-            self.setText("unavailable data type: {}".format(type(data)))
-        else:
-            color = data.getFillColor()
-            text = '{} <font color="#{:02x}{:02x}{:02x}">●</font>'\
-                .format(data.id(), color.red(), color.green(), color.blue())
-            self.setText(text)
-
-    def shape(self) -> GraspRect:
-        return self.data(Qt.UserRole + 1)
-
-    def clone(self):
-        return LabelListWidgetItem(self.shape())
-
-    def __repr__(self):
-        data = self.shape()
-        if not isinstance(data, GraspRect):
-            return "unavailable data type: {}".format(type(data))
-        else:
-            return repr(data)
-
-    def __hash__(self):
-        return id(self)
+        # 在默认大小的基础上加上圆点的宽度，QSize 只接受整数
+        size = super(ShapeItemDelegate, self).sizeHint(option, index)
+        metrics = option.fontMetrics
+        # horizontalAdvance() 从 Qt 5.11 开始才有，之前的版本使用 width()
+        advance = metrics.horizontalAdvance if hasattr(metrics, "horizontalAdvance") else metrics.width
+        width = size.width() + advance(self.BULLET)
+        return QSize(int(width), int(size.height()))
 
 
 class LabelListWidget(QListView):
-    itemDoubleClicked = pyqtSignal(LabelListWidgetItem)
+    itemDoubleClicked = pyqtSignal(object)  # shape (GraspRect)
     shapesSelectionChanged = pyqtSignal(list, list)  # (list of shape id, list of shape id)
-    shapeVisibleChanged = pyqtSignal(str, bool)  # 形状前面的小勾勾 (shape_id, checked)
-
-    # 拖放的“放”发生时需要发射的信号，意味着顺序已经改变
-    shapesOrderChanged = pyqtSignal(dict, dict)  # (old_id2idx, new_id2idx)
-    shapesAdded = pyqtSignal(list)  # list of shape (GraspRect)
     shapesRemoved = pyqtSignal(list)  # list of shape id
-    shapesAreaChanged = pyqtSignal(list)  # list of shape (GraspRect)
 
-    reconnectCanvasDataRequest = pyqtSignal()
+    AREA_UPDATE_INTERVAL = 200  # ms
 
-    # Signal: shapeOrderChanged -> canvas 改变图层
+    # 列表直接以 canvas 的 ShapeStore 为 model：增删、排序、可见性都在 store 中完成，
+    # 这里只负责选中状态的同步和删除请求
     # Signal: shapesRemoved -> canvas 删除图形
-    # Signal: shapesArea -> canvas 更改形状
 
-    def __init__(self, parent=None):
+    def __init__(self, store: ShapeStore, parent=None):
         super(LabelListWidget, self).__init__(parent)
 
-        self.setItemDelegate(HTMLDelegate())
+        self.setItemDelegate(ShapeItemDelegate(self))
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.setDragDropMode(QAbstractItemView.InternalMove)
         self.setDefaultDropAction(Qt.MoveAction)
 
-        item_model = QStandardItemModel(self)
-        item_model.setItemPrototype(LabelListWidgetItem(GraspRect()))
-        self.setModel(item_model)
+        # 切换图片时会一次性插入整张图片的形状，布局分批完成，不必立即计算每一行的大小
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(500)
+        self.setModel(store)
 
         self.doubleClicked.connect(
             lambda index:
-            self.itemDoubleClicked.emit(self.model().itemFromIndex(index))
+            self.itemDoubleClicked.emit(index.data(ShapeStore.ShapeRole))
         )
 
         self.selectionModel().selectionChanged.connect(self._shapesSelectionChangedEmit)
         self.selectionModel().selectionChanged.connect(self._scrollToLastSelected)
-        self.model().itemChanged.connect(self._shapeVisibleChangedEmit)
-
-        self.viewport().installEventFilter(self)
-        self.installEventFilter(self)  # use to judge order changed
 
-        self.id2idx = dict()
-        self.dropped = False
+        # 拖动形状时 canvas 每帧都会发出 shapesAreaChanged，这里把更新合并起来按固定间隔刷新
+        self._pending_area_shapes = dict()  # shape id -> shape
+        self._area_timer = QTimer(self)
+        self._area_timer.setSingleShot(True)
+        self._area_timer.setInterval(self.AREA_UPDATE_INTERVAL)
+        self._area_timer.timeout.connect(self.flushShapesArea)
 
     def _shapesSelectionChangedEmit(self, selected: QItemSelection, deselected: QItemSelection):
-        selected_shape_ids = [self.model().itemFromIndex(i).shape().id() for i in selected.indexes()]
-        deselcted_shape_ids = [self.model().itemFromIndex(i).shape().id() for i in deselected.indexes()]
+        selected_shape_ids = [i.data(ShapeStore.ShapeRole).id() for i in selected.indexes()]
+        deselcted_shape_ids = [i.data(ShapeStore.ShapeRole).id() for i in deselected.indexes()
+                               if i.isValid()]
         print("[INFO] [from label_list] Emit selected = {}, deselected = {}"
               .format(selected_shape_ids, deselcted_shape_ids))
         self.shapesSelectionChanged.emit(selected_shape_ids, deselcted_shape_ids)
 
-    def _shapeVisibleChangedEmit(self, item: LabelListWidgetItem):
-        print("[INFO] [from label_list] Emit shape id = {}, visible = {}"
-              .format(item.shape().id(), item.checkState() > 0))
-        self.shapeVisibleChanged.emit(item.shape().id(), item.checkState() > 0)
-
     def _scrollToLastSelected(self, selected: QItemSelection):
         indexes = selected.indexes()
         if len(indexes):
             self.scrollTo(indexes[-1], QAbstractItemView.EnsureVisible)
 
     def addShapes(self, shapes: list):
-        added_shapes = []
-        for shape in shapes:
-            assert isinstance(shape, GraspRect)
-            # shape = shape.copy(new_id=False)
-            # QStandItemModel不能存储local variable
-            if shape.id() not in self.id2idx:
-                self.id2idx[shape.id()] = self.model().rowCount()
-                self.model().appendRow(LabelListWidgetItem(shape))
-                added_shapes.append(shape)
-
-        if added_shapes:
+        # 行已经由 store 插入；只在新画出一个形状时滚动到它，载入整张图片的形状时保持在顶部
+        if len(shapes) == 1:
             self.scrollToBottom()
-            print("[INFO] [from list_view] Emit added shapes, ids = {}"
-                  .format([shape.id() for shape in added_shapes]))
-            self.shapesAdded.emit(added_shapes)
-
-    def removeShapes(self, shape_ids: list):
-        removed_shape_ids = []
-        removed_indexes = []
-        for shape_id in shape_ids:
-            if shape_id in self.id2idx:
-                idx = self.id2idx.pop(shape_id)
-                removed_indexes.append(idx)
-                removed_shape_ids.append(shape_id)
-
-        for idx in sorted(removed_indexes, reverse=True):
-            self.model().removeRow(idx)
-
-        if removed_shape_ids:
-            self.id2idx = {item.shape().id(): i for i, item in enumerate(self)}
-            print("[INFO] [from list_view] Emit removed shape ids, ids = {}"
-                  .format(removed_shape_ids))
-            self.shapesRemoved.emit(removed_shape_ids)
-
-    # def clear(self):
-    #     self.removeShapes(list(self.id2idx.keys()))
-    #
-    # def export(self):
-    #     return [item.shape().export() for item in self]
 
     def changeShapesSelection(self, select: list, deselect: list):
         """ Change shape selection
         :param select: list of shape ids.
         :param deselect: list of shape ids.
         """
-        item_model = self.model()
+        store = self.model()
 
         selection = QItemSelection()
         for shape_id in select:
-            if shape_id not in self.id2idx:
+            if shape_id not in store.id2idx:
                 continue
-            index = item_model.index(self.id2idx[shape_id], 0)
+            index = store.index(store.id2idx[shape_id], 0)
             selection.select(index, index)
 
         deselection = QItemSelection()
         for shape_id in deselect:
-            if shape_id not in self.id2idx:
+            if shape_id not in store.id2idx:
                 continue
-            index = item_model.index(self.id2idx[shape_id], 0)
+            index = store.index(store.id2idx[shape_id], 0)
             deselection.select(index, index)
 
         self.selectionModel().select(selection, QItemSelectionModel.Select)
@@ -241,44 +168,14 @@ class LabelListWidget(QListView):
     def updateShapesArea(self, shapes: list):
         for shape in shapes:
             assert isinstance(shape, GraspRect)
-            if shape.id() not in self.id2idx:
-                continue
-            item = self.model().item(self.id2idx[shape.id()])
-
-            if item.shape() is not shape:
-                item.setShape(shape)
-            item.updateText()
+            self._pending_area_shapes[shape.id()] = shape
+        if not self._area_timer.isActive():
+            self._area_timer.start()
 
-    def reconnectCanvasData(self, shapes: list):
-        for shape in shapes:
-            assert isinstance(shape, GraspRect)
-            if shape.id() not in self.id2idx:
-                continue
-            item = self.model().item(self.id2idx[shape.id()])
-            if item.shape() is not shape:
-                item.setShape(shape)
-                item.updateText()
-
-    def _checkShapesOrderChangedAndEmit(self):
-        old_id2idx = self.id2idx
-        new_id2idx = {item.shape().id(): i for i, item in enumerate(self)}
-        if old_id2idx != new_id2idx:
-            self.id2idx = new_id2idx
-            print("[INFO] [from list_view] Item num = {}".format(len(self)))
-            print("[INFO] [from list_view] Emit shape order change, old = {}, new = {}"
-                  .format(old_id2idx, new_id2idx))
-            self.shapesOrderChanged.emit(old_id2idx, new_id2idx)
-            print("[INFO] [from list_view] Emit reconnectCanvasDataRequest")
-            self.reconnectCanvasDataRequest.emit()
-
-    def eventFilter(self, obj: QObject, e: QEvent) -> bool:
-        if (e.type() == QEvent.Drop) and (obj is self.viewport()):
-            self.dropped = True
-        elif (e.type() == QEvent.ChildRemoved) and (obj is self):
-            if self.dropped:
-                self.dropped = False
-                self._checkShapesOrderChangedAndEmit()
-        return super(LabelListWidget, self).eventFilter(obj, e)
+    def flushShapesArea(self):
+        self._area_timer.stop()
+        shapes, self._pending_area_shapes = self._pending_area_shapes, dict()
+        self.model().shapesChanged(list(shapes.values()))
 
     def keyPressEvent(self, e: QKeyEvent):
         super(LabelListWidget, self).keyPressEvent(e)
@@ -287,19 +184,17 @@ class LabelListWidget(QListView):
             return
 
         if e.key() == Qt.Key_Delete:
-            remove_shape_ids = []
-            for index in self.selectedIndexes():
-                item = self[index.row()]
-                remove_shape_ids.append(item.shape().id())
-
+            remove_shape_ids = [index.data(ShapeStore.ShapeRole).id() for index in self.selectedIndexes()]
             if len(remove_shape_ids):
-                self.removeShapes(remove_shape_ids)
+                print("[INFO] [from list_view] Emit removed shape ids, ids = {}"
+                      .format(remove_shape_ids))
+                self.shapesRemoved.emit(remove_shape_ids)
 
     def __len__(self):
         return self.model().rowCount()
 
-    def __getitem__(self, i) -> LabelListWidgetItem:
-        return self.model().item(i)
+    def __getitem__(self, i) -> GraspRect:
+        return self.model().shapes[i]
 
     def __iter__(self):
         for i in range(len(self)):
@@ -0,0 +1,932 @@
+import os
+import re
+import json
+import mmap
+import time
+import uuid
+import base64
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from grasp import GraspBatch
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+SQLITE_SUFFIXES = (".db", ".sqlite")
+SHARDED_SUFFIX = ".index.json"
+# 还没有工程文件路径（只打开了图片目录）时恢复文件的默认位置，见 RecoveryJournal.forImageFolder()
+RECOVERY_FOLDER = os.path.join(os.path.expanduser("~"), ".label_grasp", "recovery")
+
+# 工程文件中记录的格式版本：
+#   1: "shapes" 为 GraspRect.export() 的 dict 列表（id, points, center, gripper_size, gripper_open, angle）
+#   2: "grasps" 只保存每个 grasp 的 (cx, cy, size, open, angle)，为 N x 5 的数值列表或 float32 数组的 base64 字符串；
+#      "ids" 为对应的形状 id 列表，points 在读取时重新计算
+# 读取时两种格式都支持，写入时总是使用当前版本；内存中的记录仍然为版本 1 的格式
+SCHEMA_VERSION = 2
+
+
+def open_project(path: str):
+    """
+    按扩展名选择工程文件的格式：
+    .db / .sqlite 为 SQLite 工程，.index.json 为分片工程（索引 + 每张图片一个文件），其他为 JSON 工程
+    """
+    if path.lower().endswith(SHARDED_SUFFIX):
+        return ShardedProject(path)
+    if os.path.splitext(path)[1].lower() in SQLITE_SUFFIXES:
+        return SqliteProject(path)
+    return JsonProject(path)
+
+
+# mkstemp 创建的文件只有所有者可以读写，替换后改为与普通新建的文件相同的权限，其他标注者也能读取
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _mkstemp(path: str):
+    """在 path 所在的目录中创建唯一的临时文件，多个进程同时保存同一个文件时不会互相覆盖临时文件；返回 (fd, tmp_path)"""
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(path) or ".")
+    os.chmod(tmp_path, 0o666 & ~_UMASK)
+    return fd, tmp_path
+
+
+def _remove_temp(tmp_path: str):
+    # 写入失败时删除临时文件
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
+
+def _write_json(path: str, obj, indent=None):
+    # 先写临时文件再替换，写入过程中断时原来的文件不受影响
+    fd, tmp_path = _mkstemp(path)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as j:
+            json.dump(obj, j, ensure_ascii=False, indent=indent)
+            j.flush()
+            os.fsync(j.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_temp(tmp_path)
+        raise
+
+
+class _FileLock(object):
+    """
+    进程间的互斥锁（对锁文件加锁），多人同时保存同一个工程时串行化读-改-写。
+    进程异常退出时锁由操作系统释放，不会留下失效的锁。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK 重试 10 秒后仍未获得锁，继续等待
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if fcntl is not None:
+            fcntl.lockf(self._file, fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
+
+
+class JsonProject(object):
+    """
+    JSON 工程文件：快照（与原来的工程文件格式相同）+ 追加写入的日志。
+    保存时只把上次保存之后改变过的图片记录追加到日志（每行一条 JSON），保存耗时只与修改量有关；
+    日志超过快照大小的一定比例后，合并为新的快照并删除日志。
+    载入时先读快照，再按顺序重放日志。每条日志记录的都是某张图片完整的最新状态。
+    快照中的 "generation" 与日志第一行相同时日志才有效，合并时如果在写完快照、删除日志之前中断，
+    旧日志会因为 generation 不同而被忽略，不会覆盖快照中更新的内容。
+
+    日志的格式（每行一条 JSON）：
+        {"generation": "..."}
+        {"file": "00001.jpg", "record": {"labeled": true, "grasps": [[cx, cy, size, open, angle], ...], "ids": [...]}}
+        {"file": "00001.jpg", "removed": true}
+
+    快照的顶层键按 indent=4 缩进，版本 2 的快照中每条记录写在一行内（版本 1 的记录按 indent=4 缩进）。
+    这样的快照载入时只建立各图片记录的字节范围索引（见 _JsonSnapshot），results["image_files"] 为 LazyImageFiles，
+    打开图片时才解析该图片的形状；合并时未修改的记录直接复制原始字节。
+    读取版本 1 的工程后，第一次保存时写完整的快照，转换为当前版本。
+    """
+
+    JOURNAL_SUFFIX = ".journal"
+    WRITE_ON_SWITCH = False
+    COMPACT_RATIO = 0.5  # 日志大小超过快照大小的这一比例时合并
+
+    def __init__(self, path: str, float32=False):
+        self.path = path
+        self.journal_path = path + self.JOURNAL_SUFFIX
+        self.float32 = float32  # grasp 参数是否保存为 float32（base64），文件更小，精度约为 7 位有效数字
+        # 快照是否与内存中的结果同源；新建的工程或换了保存路径时，第一次保存必须写完整的快照
+        self._synced = False
+        self._generation = None
+        self._version = None  # 快照的格式版本
+        self._snapshot = None  # _JsonSnapshot, 当前快照的索引
+        self._journaled = dict()  # file -> 编码后的记录，合并之后写入日志的图片，快照中的内容已过时
+        self._lock = threading.Lock()  # 合并在后台线程中替换快照时，GUI 线程可能同时在读取形状
+
+    def needsFullSave(self):
+        """下一次保存是否需要全部图片（写完整的快照）；在准备要保存的结果之前调用"""
+        return not self._synced or self._generation is None or self._version != SCHEMA_VERSION or \
+            self._shouldCompact()
+
+    def load(self) -> dict:
+        self.close()
+        self._journaled.clear()
+        self._snapshot = _JsonSnapshot.scan(self.path)
+        if self._snapshot is not None:
+            results = dict(self._snapshot.header)
+            results["image_files"] = LazyImageFiles(dict(self._snapshot.labeled), self)
+        else:
+            with open(self.path, "r", encoding="utf-8") as j:
+                results = json.load(j)
+            results["image_files"] = {file: _decode_record(record) for file, record in results["image_files"].items()}
+        self._generation = results.pop("generation", None)
+        self._version = results.pop("version", 1)
+
+        stale = False
+        if os.path.exists(self.journal_path):
+            count = 0
+            with open(self.journal_path, "r", encoding="utf-8") as j:
+                for i, line in enumerate(j):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        if i == 0:
+                            stale = True  # 第一行（代号）不完整，无法确认日志属于当前快照
+                            break
+                        continue  # 写入时被中断的不完整的行
+                    if i == 0:
+                        if not isinstance(entry, dict) or entry.get("generation") is None or \
+                                entry.get("generation") != self._generation:
+                            stale = True
+                            break
+                        continue
+                    if entry.get("removed"):
+                        results["image_files"].pop(entry["file"], None)
+                        self._journaled.pop(entry["file"], None)
+                    else:
+                        results["image_files"][entry["file"]] = _decode_record(entry["record"])
+                        self._journaled[entry["file"]] = entry["record"]
+                    count += 1
+            if stale:
+                # 例如合并时替换快照之后、删除日志之前被中断。日志留在磁盘上时，之后追加的记录没有新的代号，
+                # 下次打开时会随整个日志一起被忽略，所以下一次保存写完整的快照（同时删除日志）
+                print("[INFO] [from project_io] Ignore stale journal {}".format(self.journal_path))
+            else:
+                print("[INFO] [from project_io] Replayed {} journal record(s) from {}".format(count, self.journal_path))
+
+        self._synced = not stale
+        return results
+
+    def save(self, results: dict, changed_files=None):
+        """
+        :param changed_files: 上次保存之后改变过（包括被移除）的图片，None 表示全部（写完整的快照）。
+            不为 None 时 results 中可以只包含 changed_files 中的图片；needsFullSave() 为 True 时应传入全部图片和 None
+        """
+        if not self._synced or self._generation is None or changed_files is None:
+            self.compact(results)
+            return
+
+        lines, journaled = [], dict()
+        for file in sorted(changed_files):
+            if file in results["image_files"]:
+                entry = {"file": file, "record": _encode_record(results["image_files"][file], self.float32)}
+                journaled[file] = entry["record"]
+            else:
+                entry = {"file": file, "removed": True}
+            lines.append(json.dumps(entry, ensure_ascii=False))
+        if not lines:
+            return
+
+        if not os.path.exists(self.journal_path) or os.path.getsize(self.journal_path) == 0:
+            lines.insert(0, json.dumps({"generation": self._generation}))
+        elif not self._endsWithNewline():
+            lines.insert(0, "")  # 上一次写入被中断，从新的一行开始
+        with open(self.journal_path, "a", encoding="utf-8") as j:
+            j.write("\n".join(lines) + "\n")
+            j.flush()
+            os.fsync(j.fileno())
+        with self._lock:
+            for file in changed_files:
+                if file in journaled:
+                    self._journaled[file] = journaled[file]
+                else:
+                    self._journaled.pop(file, None)
+        print("[INFO] [from project_io] Appended {} record(s) to {}".format(len(lines), self.journal_path))
+
+    def compact(self, results: dict):
+        # 逐条写入记录，顶层键按 indent=4 缩进，每条记录写在一行内，写入时记录各记录的字节范围作为新快照的索引
+        generation = uuid.uuid4().hex
+        image_files = results["image_files"]
+        spans, labeled = dict(), dict()
+        header = {"version": SCHEMA_VERSION}
+        header.update((key, value) for key, value in results.items() if key != "image_files")
+        header["generation"] = generation
+        fd, tmp_path = _mkstemp(self.path)
+        try:
+            with os.fdopen(fd, "wb") as j:
+                j.write(b"{")
+                for i, (key, value) in enumerate(dict(header, image_files=image_files).items()):
+                    j.write((b",\n    " if i else b"\n    ") + _json_bytes(key) + b": ")
+                    if key != "image_files":
+                        j.write(_json_bytes(value, 4))
+                    elif len(image_files) == 0:
+                        j.write(b"{}")
+                    else:
+                        j.write(b"{")
+                        for k, file in enumerate(image_files):
+                            j.write((b",\n        " if k else b"\n        ") + _json_bytes(file) + b": ")
+                            data = image_files.rawRecord(file) if isinstance(image_files, LazyImageFiles) else None
+                            record = image_files[file]
+                            if data is None:
+                                data = json.dumps(_encode_record(record, self.float32), ensure_ascii=False,
+                                                  separators=(",", ":")).encode("utf-8")
+                            start = j.tell()
+                            j.write(data)
+                            spans[file] = (start, j.tell())
+                            labeled[file] = bool(record["labeled"])
+                        j.write(b"\n    }")
+                j.write(b"\n}")
+                j.flush()
+                os.fsync(j.fileno())
+
+            with self._lock:
+                if self._snapshot is not None:
+                    self._snapshot.close()
+                os.replace(tmp_path, self.path)
+                self._snapshot = _JsonSnapshot(self.path, header, spans, labeled)
+                self._journaled.clear()
+        except BaseException:
+            _remove_temp(tmp_path)
+            raise
+        self._generation = generation
+        self._version = SCHEMA_VERSION
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._synced = True
+        print("[INFO] [from project_io] Wrote snapshot {}".format(self.path))
+
+    def loadShapes(self, file: str) -> list:
+        with self._lock:
+            record = self._journaled.get(file)
+            if record is None:
+                record = json.loads(self._snapshot.read(file))
+        return _decode_record(record)["shapes"]
+
+    def loadRaw(self, file: str):
+        """记录在快照中的原始内容，快照不是当前版本或记录已写入日志（快照中的内容已过时）时返回 None"""
+        if self._version != SCHEMA_VERSION:
+            return None
+        with self._lock:
+            if file in self._journaled:
+                return None
+            return self._snapshot.read(file)
+
+    def close(self):
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot.close()
+                self._snapshot = None
+
+    def _endsWithNewline(self):
+        with open(self.journal_path, "rb") as j:
+            j.seek(0, os.SEEK_END)
+            if j.tell() == 0:
+                return True
+            j.seek(-1, os.SEEK_END)
+            return j.read(1) == b"\n"
+
+    def _shouldCompact(self):
+        if not os.path.exists(self.path):
+            return True
+        if not os.path.exists(self.journal_path):
+            return False
+        return os.path.getsize(self.journal_path) > os.path.getsize(self.path) * self.COMPACT_RATIO
+
+
+def _plain_record(record) -> dict:
+    return {"labeled": record["labeled"], "shapes": record["shapes"]}
+
+
+def _encode_grasps(shapes: list, float32=False):
+    """GraspRect.export() 格式的 dict 列表 -> 版本 2 的 "grasps"，每个 grasp 为 (cx, cy, size, open, angle)"""
+    if not shapes:
+        return []
+    if all("center" in shape for shape in shapes):
+        params = np.array([[shape["center"][0], shape["center"][1], shape["gripper_size"], shape["gripper_open"],
+                            shape["angle"]] for shape in shapes], dtype=np.float64)
+    else:
+        batch = GraspBatch.fromDicts(shapes)  # 只有 points 的记录
+        params = np.column_stack([batch.centers, batch.sizes, batch.opens, batch.angles])
+    if float32:
+        return base64.b64encode(params.astype("<f4").tobytes()).decode("ascii")
+    return params.tolist()
+
+
+def _decode_grasps(grasps, ids=None) -> list:
+    """版本 2 的 "grasps"（和 "ids"）-> GraspRect.export() 格式的 dict 列表，points 由 grasp 参数重新计算"""
+    if isinstance(grasps, str):
+        params = np.frombuffer(base64.b64decode(grasps), dtype="<f4").astype(np.float64)
+    else:
+        params = np.asarray(grasps, dtype=np.float64)
+    params = params.reshape(-1, 5)
+    if len(params) == 0:
+        return []
+    return GraspBatch(params[:, :2], params[:, 2], params[:, 3], params[:, 4], ids).export()
+
+
+def _encode_ids(shapes: list) -> list:
+    return [shape.get("id") for shape in shapes]
+
+
+def _encode_record(record, float32=False) -> dict:
+    shapes = record["shapes"]
+    return {"labeled": bool(record["labeled"]), "grasps": _encode_grasps(shapes, float32), "ids": _encode_ids(shapes)}
+
+
+def _decode_record(record: dict) -> dict:
+    if "grasps" in record:
+        return {"labeled": record["labeled"], "shapes": _decode_grasps(record["grasps"], record.get("ids"))}
+    return record  # 版本 1
+
+
+def _json_bytes(value, indent=0) -> bytes:
+    # 与 json.dump(indent=4) 中位于 indent 个空格缩进处的值相同；JSON 字符串中不会有未转义的换行
+    text = json.dumps(value, ensure_ascii=False, indent=4)
+    if indent:
+        text = text.replace("\n", "\n" + " " * indent)
+    return text.encode("utf-8")
+
+
+class _JsonSnapshot(object):
+    """
+    JSON 快照中每张图片记录的字节范围。
+    快照的顶层按 indent=4 缩进，换行只出现在值之间（JSON 字符串中不会有未转义的换行），顶层的键总是位于以 4 个空格开头的行，
+    image_files 的键总是位于以 8 个空格开头的行，记录可以是缩进的（版本 1）或者写在一行内（版本 2）。
+    只需查找这些行就能建立索引，不必解析形状；labeled 在记录范围内单独查找。
+    """
+
+    KEY_PATTERN = re.compile(rb'"((?:[^"\\\n]|\\.)*)": ')
+    RECORD_PATTERN = re.compile(rb'\n        "((?:[^"\\\n]|\\.)*)": {')
+    LABELED_PATTERN = re.compile(rb'"labeled": ?(true|false)')
+
+    def __init__(self, path: str, header: dict, spans: dict, labeled: dict):
+        self.path = path
+        self.header = header  # 除 image_files 之外的顶层键
+        self.spans = spans  # file -> (start, end), 记录在文件中的字节范围
+        self.labeled = labeled  # file -> bool
+        self._file = open(path, "rb")
+
+    @classmethod
+    def scan(cls, path: str):
+        """建立快照的索引，不是上述格式时返回 None"""
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if re.match(rb'{\r?\n    "', mm) is None:
+                    return None
+                return cls._scan(path, mm)
+
+    @classmethod
+    def _scan(cls, path: str, mm):
+        header, spans, labeled = dict(), dict(), dict()
+
+        # image_files 之前的顶层键
+        pos = 0
+        while True:
+            m = cls._matchKey(mm, mm.find(b'\n    "', pos), 4)
+            if m is None:
+                return None
+            key = cls._decodeKey(m.group(1))
+            if key == "image_files":
+                break
+            header[key] = cls._decodeValue(mm, m.end(), mm.find(b'\n    "', m.end()))
+            pos = m.end()
+
+        # image_files 的键位于以 8 个空格开头的行，值总是对象；正则表达式的查找比逐个 find() 快得多
+        files = []  # (file, start of record, start of line)
+        pos = m.end()
+        if mm[pos:pos + 2] != b"{}":
+            for k in cls.RECORD_PATTERN.finditer(mm, pos):
+                files.append((cls._decodeKey(k.group(1)), k.end() - 1, k.start()))
+            files_end = mm.find(b"\n    }", files[-1][1] if files else pos)
+            while files and files[-1][1] > files_end:
+                files.pop()  # image_files 之后的顶层对象中的键
+        else:
+            files_end = pos + 2
+
+        for k, (file, start, _) in enumerate(files):
+            # 记录结束于下一个键所在行（或 image_files 结束的一行）之前的最后一个 "}"
+            stop = files[k + 1][2] if k + 1 < len(files) else files_end
+            end = mm.rfind(b"}", start, stop) + 1
+            spans[file] = (start, end)
+            m = cls.LABELED_PATTERN.search(mm, start, end)
+            labeled[file] = m.group(1) == b"true" if m is not None else bool(json.loads(mm[start:end])["labeled"])
+
+        # image_files 之后的顶层键
+        pos = files_end
+        while True:
+            m = cls._matchKey(mm, mm.find(b'\n    "', pos), 4)
+            if m is None:
+                break
+            key = cls._decodeKey(m.group(1))
+            header[key] = cls._decodeValue(mm, m.end(), mm.find(b'\n    "', m.end()))
+            pos = m.end()
+        return cls(path, header, spans, labeled)
+
+    @classmethod
+    def _matchKey(cls, mm, line: int, indent: int):
+        # line 为换行符的位置，其后是 indent 个空格和键
+        if line < 0 or mm[line + 1:line + 1 + indent] != b" " * indent:
+            return None
+        return cls.KEY_PATTERN.match(mm, line + 1 + indent)
+
+    @staticmethod
+    def _decodeKey(raw: bytes) -> str:
+        return raw.decode("utf-8") if b"\\" not in raw else json.loads(b'"' + raw + b'"')
+
+    @staticmethod
+    def _decodeValue(mm, start: int, stop: int):
+        return json.JSONDecoder().raw_decode(mm[start:stop if stop >= 0 else len(mm)].decode("utf-8").lstrip())[0]
+
+    def read(self, file: str) -> bytes:
+        start, end = self.spans[file]
+        self._file.seek(start)
+        return self._file.read(end - start)
+
+    def close(self):
+        self._file.close()
+
+
+def snapshot_results(results: dict, changed_files, full: bool) -> dict:
+    """
+    在 GUI 线程中为后台保存复制一份结果，之后 GUI 线程对 results 的修改不影响正在写入的内容。
+    记录中的 "labeled" 和 "shapes" 在修改时总是整体替换，只需复制改变过的记录本身。
+    :param full: 是否需要全部图片（写完整的快照）；否则只包含 changed_files 中的图片
+    """
+    image_files = results["image_files"]
+    if isinstance(image_files, dict):
+        snapshot = dict(image_files)
+    elif full:
+        snapshot = image_files.copy()
+    else:
+        snapshot = dict()
+    for file in changed_files:
+        if file in image_files:
+            snapshot[file] = _plain_record(image_files[file])
+    return dict(results, image_files=snapshot)
+
+
+class RecoveryJournal(object):
+    """
+    自动保存的恢复文件（工程文件路径 + ".recovery"），保存上次保存工程之后改变过的图片的最新状态。
+    每次自动保存时整体重写（先写临时文件再替换），大小只与修改量有关；正常保存工程后删除。
+    打开工程时如果存在恢复文件，可以把其中的记录重放到载入的结果中。
+    还没有工程文件路径时恢复文件位于 RECOVERY_FOLDER 中，按图片目录区分（见 forImageFolder()）。
+
+    格式：
+        {"time": "...", "version": 2,
+         "image_files": {"00001.jpg": {"labeled": true, "grasps": [...]}, "00002.jpg": null}}
+    null 表示该图片已从工程中移除。
+    """
+
+    SUFFIX = ".recovery"
+
+    def __init__(self, project_path: str):
+        self.path = project_path + self.SUFFIX
+
+    @classmethod
+    def forImageFolder(cls, image_folder: str):
+        """只打开了图片目录、还没有保存过工程时使用的恢复文件，文件名由图片目录的绝对路径决定"""
+        folder = os.path.normcase(os.path.abspath(image_folder))
+        return cls(os.path.join(RECOVERY_FOLDER, hashlib.sha1(folder.encode("utf-8")).hexdigest()))
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self, results: dict, changed_files=None):
+        image_files = results["image_files"]
+        entries = {file: _encode_record(image_files[file]) if file in image_files else None
+                   for file in (image_files if changed_files is None else changed_files)}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        _write_json(self.path, {"time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                                "version": SCHEMA_VERSION, "image_files": entries})
+        print("[INFO] [from project_io] Autosaved {} image(s) to {}".format(len(entries), self.path))
+
+    def load(self) -> dict:
+        with open(self.path, "r", encoding="utf-8") as j:
+            return json.load(j)
+
+    def replay(self, results: dict, recovery: dict) -> set:
+        """把 load() 读取的记录写入 results，返回改变的图片"""
+        image_files = results["image_files"]
+        for file, record in recovery["image_files"].items():
+            if record is None:
+                image_files.pop(file, None)
+            else:
+                image_files[file] = _decode_record(record)
+        print("[INFO] [from project_io] Replayed {} image(s) from {}".format(len(recovery["image_files"]), self.path))
+        return set(recovery["image_files"])
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _LazyRecord(dict):
+    """LazyImageFiles 中一张图片的记录，"shapes" 在第一次访问时才读取；被修改后固定在内存中直到保存"""
+
+    def __init__(self, files, file: str, labeled: bool):
+        super(_LazyRecord, self).__init__(labeled=labeled)
+        self._files = files
+        self._file = file
+
+    def __missing__(self, key):
+        if key != "shapes":
+            raise KeyError(key)
+        shapes = self._files.source.loadShapes(self._file)
+        dict.__setitem__(self, "shapes", shapes)
+        self._files._cache(self._file, self)
+        return shapes
+
+    def __setitem__(self, key, value):
+        super(_LazyRecord, self).__setitem__(key, value)
+        self._files._pin(self._file, self)
+
+
+class LazyImageFiles(MutableMapping):
+    """
+    SQLite 工程、分片工程的 results["image_files"]。
+    内存中只保存所有图片的文件名和 labeled，形状在访问某张图片的 "shapes" 时才用 source.loadShapes(file) 读取，
+    读取过的记录按 LRU 最多缓存 MAX_CACHED 张；被修改（或新加入）的记录在保存之前一直保留。
+    """
+
+    MAX_CACHED = 256
+
+    def __init__(self, labeled: dict, source):
+        self.source = source  # 记录所在的工程，JsonProject / SqliteProject / ShardedProject
+        self._labeled = labeled  # file -> bool
+        self._records = OrderedDict()  # file -> _LazyRecord, 读取过形状的记录，最近使用的在最后
+        self._dirty = dict()  # file -> record, 被修改过、尚未保存的记录
+
+    def __getitem__(self, file):
+        record = self._dirty.get(file)
+        if record is not None:
+            return record
+        record = self._records.get(file)
+        if record is not None:
+            self._records.move_to_end(file)
+            return record
+        return _LazyRecord(self, file, self._labeled[file])
+
+    def __setitem__(self, file, record):
+        self._records.pop(file, None)
+        self._labeled[file] = bool(record["labeled"])
+        self._dirty[file] = record
+
+    def __delitem__(self, file):
+        del self._labeled[file]
+        self._records.pop(file, None)
+        self._dirty.pop(file, None)
+
+    def __contains__(self, file):
+        return file in self._labeled
+
+    def __iter__(self):
+        return iter(self._labeled)
+
+    def __len__(self):
+        return len(self._labeled)
+
+    def copy(self):
+        """供后台保存使用的副本：文件名和修改过的记录在复制时确定，其余记录之后从 source 读取"""
+        files = LazyImageFiles(dict(self._labeled), self.source)
+        files._dirty = {file: _plain_record(record) for file, record in self._dirty.items()}
+        return files
+
+    def rawRecord(self, file: str):
+        """未修改的记录在工程文件中的原始内容（bytes），工程不支持或记录已修改时返回 None"""
+        if file in self._dirty or not hasattr(self.source, "loadRaw"):
+            return None
+        return self.source.loadRaw(file)
+
+    def release(self, files=None):
+        """files（None 表示全部）已写入工程文件，不必再固定在内存中"""
+        for file in (list(self._dirty) if files is None else files):
+            record = self._dirty.pop(file, None)
+            if isinstance(record, _LazyRecord) and "shapes" in record:
+                self._cache(file, record)
+
+    def _pin(self, file: str, record: dict):
+        if file not in self._labeled:
+            return  # 已被移除
+        self._records.pop(file, None)
+        self._labeled[file] = bool(record["labeled"])
+        self._dirty[file] = record
+
+    def _cache(self, file: str, record: dict):
+        if file in self._dirty:
+            return
+        self._records[file] = record
+        self._records.move_to_end(file)
+        while len(self._records) > self.MAX_CACHED:
+            self._records.popitem(last=False)
+
+
+class SqliteProject(object):
+    """
+    SQLite 工程文件：图片、labeled 和 grasp 分别存放在带索引的表中。
+    载入时只读取文件名和 labeled，各图片的形状在打开该图片时才读取（见 LazyImageFiles），
+    保存时只写入改变过的图片，切换图片时也立即写入刚离开的图片，内存占用与工程大小无关。
+    可以直接在数据库中查询，例如未标注的图片、grasp 少于 N 个的图片，不必载入整个工程。
+
+    表结构：
+        meta(key, value)                 image_folder
+        images(id, name, labeled)
+        grasps(image_id, idx, shape_id, cx, cy, size, open, angle)
+    """
+
+    WRITE_ON_SWITCH = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS images (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            labeled INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS images_labeled ON images (labeled);
+        CREATE TABLE IF NOT EXISTS grasps (
+            image_id INTEGER NOT NULL,
+            idx INTEGER NOT NULL,
+            shape_id TEXT,
+            cx REAL, cy REAL, size REAL, open REAL, angle REAL,
+            PRIMARY KEY (image_id, idx)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        # 保存在后台线程中进行，GUI 线程同时会读取形状，连接的所有使用都需要持有此锁
+        self._lock = threading.RLock()
+        self._synced = False
+
+    def needsFullSave(self):
+        return not self._synced
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    def load(self) -> dict:
+        self.close()
+        with self._lock:
+            self._conn = self._connect(self.path)
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'image_folder'").fetchone()
+            labeled = {file: bool(labeled) for file, labeled in self._conn.execute("SELECT name, labeled FROM images")}
+        results = {
+            "image_folder": row[0] if row is not None else "unknown",
+            "image_files": LazyImageFiles(labeled, self)
+        }
+        self._synced = True
+        print("[INFO] [from project_io] Opened {} image(s) from {}".format(len(results["image_files"]), self.path))
+        return results
+
+    def save(self, results: dict, changed_files=None):
+        """
+        :param changed_files: 上次保存之后改变过（包括被移除）的图片，None 表示全部
+        """
+        if not self._synced or changed_files is None:
+            self.compact(results)
+            return
+
+        image_files = results["image_files"]
+        with self._lock, self._conn:  # 一个事务
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('image_folder', ?)", (results["image_folder"],))
+            for file in changed_files:
+                if file in image_files:
+                    self._writeImage(self._conn, file, image_files[file])
+                else:
+                    self._removeImage(self._conn, file)
+        if isinstance(image_files, LazyImageFiles):
+            image_files.release(changed_files)
+        print("[INFO] [from project_io] Wrote {} image(s) to {}".format(len(changed_files), self.path))
+
+    def compact(self, results: dict):
+        # 写入完整的新数据库，写完后替换，写入过程中断时原来的文件不受影响
+        fd, tmp_path = _mkstemp(self.path)
+        os.close(fd)
+        image_files = results["image_files"]
+        try:
+            conn = self._connect(tmp_path)
+            try:
+                with conn:
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('image_folder', ?)", (results["image_folder"],))
+                    for file in image_files:
+                        self._writeImage(conn, file, image_files[file])
+            finally:
+                conn.close()
+        except BaseException:
+            _remove_temp(tmp_path)
+            raise
+
+        with self._lock:
+            self.close()
+            os.replace(tmp_path, self.path)
+            self._conn = self._connect(self.path)
+        if isinstance(image_files, LazyImageFiles):
+            # 新数据库中已包含全部记录，之后从新数据库读取形状
+            image_files.source = self
+            image_files.release()
+        self._synced = True
+        print("[INFO] [from project_io] Wrote database {}".format(self.path))
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @staticmethod
+    def _writeImage(conn: sqlite3.Connection, file: str, record: dict):
+        conn.execute("INSERT INTO images (name, labeled) VALUES (?, ?) "
+                     "ON CONFLICT (name) DO UPDATE SET labeled = excluded.labeled", (file, int(record["labeled"])))
+        image_id = conn.execute("SELECT id FROM images WHERE name = ?", (file,)).fetchone()[0]
+        conn.execute("DELETE FROM grasps WHERE image_id = ?", (image_id,))
+        shapes = record["shapes"]
+        if shapes:
+            batch = GraspBatch.fromExported(shapes)
+            conn.executemany(
+                "INSERT INTO grasps VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                zip([image_id] * len(batch), range(len(batch)), [shape.get("id") for shape in shapes],
+                    batch.centers[:, 0].tolist(), batch.centers[:, 1].tolist(),
+                    batch.sizes.tolist(), batch.opens.tolist(), batch.angles.tolist())
+            )
+
+    def loadShapes(self, file: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT g.shape_id, g.cx, g.cy, g.size, g.open, g.angle FROM grasps g "
+                "JOIN images i ON g.image_id = i.id WHERE i.name = ? ORDER BY g.idx", (file,)
+            ).fetchall()
+        if not rows:
+            return []
+        ids, cx, cy, sizes, opens, angles = zip(*rows)
+        return GraspBatch(list(zip(cx, cy)), sizes, opens, angles, ids).export()
+
+    @staticmethod
+    def _removeImage(conn: sqlite3.Connection, file: str):
+        conn.execute("DELETE FROM grasps WHERE image_id IN (SELECT id FROM images WHERE name = ?)", (file,))
+        conn.execute("DELETE FROM images WHERE name = ?", (file,))
+
+    # ---------------- queries ----------------
+    # 查询的是已写入数据库的状态
+
+    def unlabeledImages(self) -> list:
+        with self._lock:
+            return [name for name, in self._conn.execute("SELECT name FROM images WHERE labeled = 0 ORDER BY name")]
+
+    def imagesWithFewerGrasps(self, n: int) -> list:
+        with self._lock:
+            return [name for name, in self._conn.execute(
+                "SELECT i.name FROM images i LEFT JOIN grasps g ON g.image_id = i.id "
+                "GROUP BY i.id HAVING COUNT(g.image_id) < ? ORDER BY i.name", (n,)
+            )]
+
+
+class ShardedProject(object):
+    """
+    分片工程：轻量的索引文件（xxx.index.json）只保存图片列表和 labeled，
+    每张图片的形状保存在 xxx.shards/ 目录下各自的文件中（按文件名的 SHA-1 分散到 256 个子目录）。
+    保存时只写入改变过的图片；索引在写入前重新读取磁盘上的版本，只合并本次改变的图片，
+    因此多人分别标注同一数据集中互不相交的部分时不会覆盖彼此的结果。
+    完整保存也只合并本次的全部图片，不从索引中移除任何图片（移除只能通过增量保存的 changed_files 表示）。
+
+    索引的格式：
+        {"version": 2, "image_folder": "...", "image_files": {"00001.jpg": true, ...}}
+    图片文件的格式（版本 1 为 {"file": "00001.jpg", "shapes": [...]}，同样可以读取）：
+        {"file": "00001.jpg", "grasps": [[cx, cy, size, open, angle], ...], "ids": [...]}
+    版本 1 的图片文件不整体转换（整体重写会覆盖其他人的结果），在该图片下次保存时写为当前版本。
+    """
+
+    WRITE_ON_SWITCH = False
+
+    def __init__(self, path: str, float32=False):
+        self.path = path
+        self.float32 = float32
+        self.shard_dir = (path[:-len(SHARDED_SUFFIX)] if path.lower().endswith(SHARDED_SUFFIX) else path) + ".shards"
+        self._synced = False
+
+    def needsFullSave(self):
+        return not self._synced
+
+    def load(self) -> dict:
+        index = self._readIndex()
+        results = {
+            "image_folder": index.get("image_folder", "unknown"),
+            "image_files": LazyImageFiles(
+                {file: bool(labeled) for file, labeled in index.get("image_files", {}).items()},
+                self
+            )
+        }
+        self._synced = True
+        print("[INFO] [from project_io] Opened {} image(s) from {}".format(len(results["image_files"]), self.path))
+        return results
+
+    def save(self, results: dict, changed_files=None):
+        """
+        :param changed_files: 上次保存之后改变过（包括被移除）的图片，None 表示全部
+        """
+        image_files = results["image_files"]
+        full = not self._synced or changed_files is None
+        changes = dict()  # file -> labeled, None 表示已移除
+        for file in (image_files if full else changed_files):
+            if file in image_files:
+                record = image_files[file]
+                changes[file] = bool(record["labeled"])
+                self._writeShapes(file, record["shapes"])
+            else:
+                changes[file] = None
+                self._writeShapes(file, [])
+        if full and isinstance(image_files, LazyImageFiles):
+            # 所有图片都已写入新的位置，之后从这里读取形状
+            image_files.source = self
+
+        # 索引的读-改-写在进程间的锁中进行，多人同时保存时不会丢失其他人刚合并进去的图片。
+        # 完整保存（例如第一次保存到已有的共享工程）同样与磁盘上的索引合并，其他人写入的图片不会被丢掉
+        with _FileLock(self.path + ".lock"):
+            labeled = self._readIndex().get("image_files", {}) if os.path.exists(self.path) else dict()
+            for file, flag in changes.items():
+                if flag is None:
+                    labeled.pop(file, None)
+                else:
+                    labeled[file] = flag
+            _write_json(self.path, {"version": SCHEMA_VERSION, "image_folder": results["image_folder"],
+                                    "image_files": labeled})
+        if isinstance(image_files, LazyImageFiles):
+            image_files.release(None if full else changed_files)
+        self._synced = True
+        print("[INFO] [from project_io] Wrote {} image(s) to {}".format(len(changes), self.shard_dir))
+
+    def close(self):
+        pass
+
+    def _readIndex(self) -> dict:
+        with open(self.path, "r", encoding="utf-8") as j:
+            return json.load(j)
+
+    def _shardPath(self, file: str):
+        digest = hashlib.sha1(file.encode("utf-8")).hexdigest()
+        return os.path.join(self.shard_dir, digest[:2], digest + ".json")
+
+    def loadShapes(self, file: str) -> list:
+        try:
+            with open(self._shardPath(file), "r", encoding="utf-8") as j:
+                data = json.load(j)
+        except FileNotFoundError:
+            return []  # 没有形状的图片不保存文件
+        return _decode_grasps(data["grasps"], data.get("ids")) if "grasps" in data else data["shapes"]
+
+    def _writeShapes(self, file: str, shapes: list):
+        path = self._shardPath(file)
+        if not shapes:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_json(path, {"file": file, "grasps": _encode_grasps(shapes, self.float32), "ids": _encode_ids(shapes)})
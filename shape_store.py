@@ -0,0 +1,169 @@
+from PyQt5.QtGui import *
+from PyQt5.QtCore import *
+
+from grasp import GraspRect
+
+
+class ShapeStore(QAbstractListModel):
+    """
+    canvas 和形状列表共享的、唯一的有序形状存储。
+    canvas 通过 addShapes() / removeShapes() 修改它，列表视图直接以它为 model 读取数据，
+    拖放排序通过 moveRows() 完成，不再需要两边各自维护一份数据再互相同步。
+    """
+
+    ShapeRole = Qt.UserRole + 1
+    ColorRole = Qt.UserRole + 2
+
+    shapesOrderChanged = pyqtSignal()
+    shapeVisibleChanged = pyqtSignal(str, bool)  # (shape_id, visible)
+
+    def __init__(self, parent=None):
+        super(ShapeStore, self).__init__(parent)
+        # 使用字典存储shape的id到列表下标的映射，加快处理速度
+        self.shapes = list()
+        self.id2idx = dict()
+
+    # ---------------- model interface ----------------
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.shapes)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid() or not (0 <= index.row() < len(self.shapes)):
+            return None
+        shape = self.shapes[index.row()]
+
+        if role == Qt.DisplayRole:
+            return shape.id()  # 颜色通过 ColorRole 提供，由 delegate 绘制
+        elif role == Qt.CheckStateRole:
+            return Qt.Checked if shape.visible() else Qt.Unchecked
+        elif role == Qt.TextAlignmentRole:
+            return Qt.AlignBottom
+        elif role == self.ShapeRole:
+            return shape
+        elif role == self.ColorRole:
+            color = shape.getFillColor()
+            color.setAlpha(255)  # 列表中只显示色相，不随选中 / 悬停状态变化透明度
+            return color
+        return None
+
+    def setData(self, index: QModelIndex, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.CheckStateRole:
+            return False
+        shape = self.shapes[index.row()]
+        visible = (value == Qt.Checked)
+        if shape.visible() != visible:
+            shape.setVisible(visible)
+            self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+            print("[INFO] [from shape_store] Emit shape id = {}, visible = {}".format(shape.id(), visible))
+            self.shapeVisibleChanged.emit(shape.id(), visible)
+        return True
+
+    def flags(self, index: QModelIndex):
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled  # 只允许放在两项之间
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable \
+            | Qt.ItemIsDragEnabled | Qt.ItemNeverHasChildren
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def moveRows(self, source_parent: QModelIndex, source_row: int, count: int,
+                 destination_parent: QModelIndex, destination_child: int):
+        if source_parent.isValid() or destination_parent.isValid() or count <= 0:
+            return False
+        if source_row <= destination_child <= source_row + count:
+            return False  # 移动到自身所在的位置
+        if not self.beginMoveRows(source_parent, source_row, source_row + count - 1,
+                                  destination_parent, destination_child):
+            return False
+
+        moved = self.shapes[source_row:source_row + count]
+        del self.shapes[source_row:source_row + count]
+        insert_row = destination_child if destination_child < source_row else destination_child - count
+        self.shapes[insert_row:insert_row] = moved
+        self._reindex(min(source_row, insert_row), max(source_row, insert_row) + count)
+
+        self.endMoveRows()
+        self.shapesOrderChanged.emit()
+        return True
+
+    # ---------------- store interface ----------------
+
+    def _reindex(self, start=0, stop=None):
+        stop = len(self.shapes) if stop is None else stop
+        for i in range(start, stop):
+            self.id2idx[self.shapes[i].id()] = i
+
+    def addShapes(self, shapes: list):
+        added_shapes = []
+        added_ids = set()
+        for shape in shapes:
+            assert isinstance(shape, GraspRect)
+            if (shape.id() not in self.id2idx) and (shape.id() not in added_ids):
+                added_ids.add(shape.id())
+                added_shapes.append(shape)
+
+        if added_shapes:
+            first = len(self.shapes)
+            self.beginInsertRows(QModelIndex(), first, first + len(added_shapes) - 1)
+            self.shapes.extend(added_shapes)
+            self._reindex(first)
+            self.endInsertRows()
+        return added_shapes
+
+    def removeShapes(self, shape_ids: list):
+        rows = sorted({self.id2idx[shape_id] for shape_id in shape_ids if shape_id in self.id2idx})
+        if not rows:
+            return []
+        removed_shapes = [self.shapes[row] for row in rows]
+
+        # 连续的行合并为一次删除，从后往前删
+        ranges = []
+        for row in rows:
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        for first, last in reversed(ranges):
+            self.beginRemoveRows(QModelIndex(), first, last)
+            del self.shapes[first:last + 1]
+            self.endRemoveRows()
+
+        for shape in removed_shapes:
+            del self.id2idx[shape.id()]
+        self._reindex(rows[0])
+        return removed_shapes
+
+    def setVisible(self, shape_id: str, visible: bool):
+        if shape_id in self.id2idx:
+            self.setData(self.index(self.id2idx[shape_id]), Qt.Checked if visible else Qt.Unchecked,
+                         Qt.CheckStateRole)
+
+    def shapesChanged(self, shapes: list):
+        # 按连续的行区间发出 dataChanged
+        rows = sorted(self.id2idx[shape.id()] for shape in shapes if shape.id() in self.id2idx)
+        start = None
+        for i, row in enumerate(rows):
+            if start is None:
+                start = row
+            if (i + 1 == len(rows)) or (rows[i + 1] != row + 1):
+                self.dataChanged.emit(self.index(start), self.index(row),
+                                      [Qt.DisplayRole, self.ColorRole])
+                start = None
+
+    def shape(self, shape_id: str) -> GraspRect:
+        idx = self.id2idx.get(shape_id)
+        return None if idx is None else self.shapes[idx]
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __getitem__(self, i) -> GraspRect:
+        return self.shapes[i]
+
+    def __iter__(self):
+        return iter(self.shapes)
+
+    def __contains__(self, shape_id):
+        return shape_id in self.id2idx
@@ -0,0 +1,106 @@
+import math
+import numpy as np
+
+
+class GridIndex(object):
+    """
+    均匀网格空间索引：每个 key（形状 id）登记其包围盒覆盖到的所有网格，
+    查询时只返回与查询点 / 查询矩形所在网格相关的 key，避免线性扫描所有形状。
+    包围盒格式为 (x0, y0, x1, y1)，坐标为 painter 坐标系。
+    """
+
+    def __init__(self, cell_size=64.):
+        self.cell_size = float(cell_size)
+        self._cells = dict()  # (cx, cy) -> set of keys
+        self._key2range = dict()  # key -> (cx0, cy0, cx1, cy1)
+        self._key2bbox = dict()  # key -> (x0, y0, x1, y1)
+
+    def _cellRange(self, x0, y0, x1, y1):
+        return (int(math.floor(x0 / self.cell_size)), int(math.floor(y0 / self.cell_size)),
+                int(math.floor(x1 / self.cell_size)), int(math.floor(y1 / self.cell_size)))
+
+    def _register(self, key, bbox, cell_range):
+        self._key2bbox[key] = tuple(bbox)
+        cx0, cy0, cx1, cy1 = cell_range
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                self._cells.setdefault((cx, cy), set()).add(key)
+        self._key2range[key] = cell_range
+
+    def insert(self, key, bbox):
+        if key in self._key2range:
+            self.remove(key)
+        self._register(key, bbox, self._cellRange(*bbox))
+
+    def insertMany(self, keys: list, bboxes: np.ndarray):
+        # bboxes: (N, 4)，网格下标一次性向量化计算
+        if len(keys) == 0:
+            return
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        ranges = np.floor(bboxes / self.cell_size).astype(np.int64)
+        for key, bbox, cell_range in zip(keys, bboxes.tolist(), ranges.tolist()):
+            if key in self._key2range:
+                self.remove(key)
+            self._register(key, bbox, tuple(cell_range))
+
+    def update(self, key, bbox):
+        cell_range = self._cellRange(*bbox)
+        if self._key2range.get(key) != cell_range:
+            self.remove(key)
+            self._register(key, bbox, cell_range)
+        else:
+            self._key2bbox[key] = tuple(bbox)
+
+    def remove(self, key):
+        cell_range = self._key2range.pop(key, None)
+        if cell_range is None:
+            return
+        del self._key2bbox[key]
+        cx0, cy0, cx1, cy1 = cell_range
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                keys = self._cells.get((cx, cy))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._cells[(cx, cy)]
+
+    def clear(self):
+        self._cells.clear()
+        self._key2range.clear()
+        self._key2bbox.clear()
+
+    def queryPoint(self, x, y, radius=0.):
+        return self.queryRect(x - radius, y - radius, x + radius, y + radius)
+
+    def queryRect(self, x0, y0, x1, y1):
+        """返回包围盒与矩形 (x0, y0, x1, y1) 相交的所有 key"""
+        cx0, cy0, cx1, cy1 = self._cellRange(x0, y0, x1, y1)
+        candidates = set()
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            # 查询范围比已占用的网格还多时，直接遍历已占用的网格
+            for (cx, cy), keys in self._cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    candidates.update(keys)
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    keys = self._cells.get((cx, cy))
+                    if keys is not None:
+                        candidates.update(keys)
+
+        result = set()
+        for key in candidates:
+            bx0, by0, bx1, by1 = self._key2bbox[key]
+            if bx0 <= x1 and x0 <= bx1 and by0 <= y1 and y0 <= by1:
+                result.add(key)
+        return result
+
+    def bbox(self, key):
+        return self._key2bbox.get(key)
+
+    def __len__(self):
+        return len(self._key2range)
+
+    def __contains__(self, key):
+        return key in self._key2range
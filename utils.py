@@ -59,6 +59,12 @@ def norm_angle(a):
     return a
 
 
+def norm_angles(a: np.ndarray):
+    # vectorized version of norm_angle(), maps angles into (-pi, pi]
+    a = np.mod(a + math.pi, math.pi * 2) - math.pi
+    return np.where(a <= -math.pi, a + math.pi * 2, a)
+
+
 class Struct(object):
     def __init__(self, **kwargs):
         self.__dict__.update(**kwargs)
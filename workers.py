@@ -0,0 +1,185 @@
+import os
+import time
+import threading
+
+from PyQt5.QtCore import *
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, List
+
+
+class DirScanner(QThread):
+    """
+    在后台线程中用 os.scandir 枚举目录下的图片，边扫描边分批发出结果，
+    不必等整个目录（例如网络挂载的几十万张图片）枚举完才显示文件列表。
+    返回的文件名为相对于 root 的路径，每一批内部按文件名排序。
+    """
+
+    filesFound = pyqtSignal(list)  # list of file name (relative to root)
+    scanFinished = pyqtSignal(int)  # total number of files found
+
+    BATCH_SIZE = 2000
+    BATCH_INTERVAL = 0.1  # s, 扫描较慢时也按时间间隔发出已找到的文件
+
+    def __init__(self, root: str, extensions: Iterable[str], recursive=False, parent=None):
+        super(DirScanner, self).__init__(parent)
+        self.root = root
+        self.extensions = {ext.lower().lstrip(".") for ext in extensions}
+        self.recursive = recursive
+
+    def _match(self, name: str):
+        # 扩展名不区分大小写
+        return os.path.splitext(name)[1][1:].lower() in self.extensions
+
+    def run(self):
+        total = 0
+        batch = []
+        last_emit = time.perf_counter()
+        dirs = [""]  # 待扫描的子目录，相对于 root
+
+        while dirs and not self.isInterruptionRequested():
+            rel_dir = dirs.pop()
+            try:
+                it = os.scandir(os.path.join(self.root, rel_dir))
+            except OSError as e:
+                print("[WARNING] [from workers] Cannot scan {}: {}".format(rel_dir or self.root, e))
+                continue
+
+            with it:
+                for entry in it:
+                    if self.isInterruptionRequested():
+                        break
+                    try:
+                        if entry.is_file():
+                            if self._match(entry.name):
+                                batch.append(os.path.join(rel_dir, entry.name) if rel_dir else entry.name)
+                        elif self.recursive and entry.is_dir(follow_symlinks=False):
+                            dirs.append(os.path.join(rel_dir, entry.name) if rel_dir else entry.name)
+                    except OSError:
+                        continue
+
+                    now = time.perf_counter()
+                    if len(batch) >= self.BATCH_SIZE or (batch and now - last_emit >= self.BATCH_INTERVAL):
+                        total += self._emitBatch(batch)
+                        batch = []
+                        last_emit = now
+
+        if batch and not self.isInterruptionRequested():
+            total += self._emitBatch(batch)
+        print("[INFO] [from workers] Scan finished, {} file(s) found".format(total))
+        self.scanFinished.emit(total)
+
+    def _emitBatch(self, batch: list):
+        batch.sort()
+        self.filesFound.emit(batch)
+        return len(batch)
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
+
+
+class ExistenceChecker(QThread):
+    """
+    用线程池并发检查文件是否存在（网络文件系统上逐个 os.path.exists 很慢），
+    每检查完一块就发出其中缺失文件的下标，调用方可以先使用已载入的工程，再逐步标记缺失的文件。
+    """
+
+    filesMissing = pyqtSignal(list)  # list of index of missing files
+    progressChanged = pyqtSignal(int, int)  # (checked, total)
+    checkFinished = pyqtSignal(list, bool)  # (list of index of all missing files, canceled)
+
+    CHUNK_SIZE = 256
+    MAX_WORKERS = 32
+
+    def __init__(self, paths: List[str], parent=None):
+        super(ExistenceChecker, self).__init__(parent)
+        self.paths = paths
+
+    def _checkChunk(self, start: int, stop: int):
+        missing = []
+        for i in range(start, stop):
+            if self.isInterruptionRequested():
+                break
+            if not os.path.exists(self.paths[i]):
+                missing.append(i)
+        return stop - start, missing
+
+    def run(self):
+        total = len(self.paths)
+        checked = 0
+        all_missing = []
+
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as pool:
+            futures = [pool.submit(self._checkChunk, start, min(start + self.CHUNK_SIZE, total))
+                       for start in range(0, total, self.CHUNK_SIZE)]
+            for future in as_completed(futures):
+                if self.isInterruptionRequested():
+                    # 取消还没有开始的分块（shutdown 的 cancel_futures 参数需要 Python 3.9），正在检查的分块会很快结束
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                count, missing = future.result()
+                checked += count
+                if missing:
+                    all_missing.extend(missing)
+                    self.filesMissing.emit(missing)
+                self.progressChanged.emit(checked, total)
+
+        canceled = self.isInterruptionRequested()
+        all_missing.sort()
+        print("[INFO] [from workers] Existence check {}, {} of {} file(s) missing"
+              .format("canceled" if canceled else "finished", len(all_missing), total))
+        self.checkFinished.emit(all_missing, canceled)
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
+
+
+class ProjectSaver(QObject):
+    """
+    在单独的线程中按提交的顺序写入工程文件，GUI 线程只需准备好结果的快照（见 project_io.snapshot_results）。
+    写入完成（或失败）后发出 saveFinished，排队到 GUI 线程中处理。
+    """
+
+    saveFinished = pyqtSignal(object, object, str)  # (project, set of saved files or None for all, error message or "")
+
+    def __init__(self, parent=None):
+        super(ProjectSaver, self).__init__(parent)
+        self._pool = ThreadPoolExecutor(max_workers=1)  # 只有一个写入线程，保证写入顺序
+        self._pending = []  # list of Future
+        # 尚未写完的提交数，在发出 saveFinished 之前减少，处理 saveFinished 时 isBusy() 只反映之后的写入
+        self._queued = 0
+        self._queued_lock = threading.Lock()
+
+    def save(self, project, results: dict, changed_files):
+        self._pending = [f for f in self._pending if not f.done()]
+        with self._queued_lock:
+            self._queued += 1
+        self._pending.append(self._pool.submit(self._write, project, results, changed_files))
+
+    def _write(self, project, results: dict, changed_files):
+        try:
+            project.save(results, changed_files)
+            error = ""
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+            print("[WARNING] [from workers] Saving {} failed: {}".format(project.path, error))
+        with self._queued_lock:
+            self._queued -= 1
+        self.saveFinished.emit(project, changed_files, error)
+
+    def isBusy(self):
+        with self._queued_lock:
+            return self._queued > 0
+
+    def waitForDone(self):
+        """阻塞直到已提交的写入全部完成"""
+        for future in self._pending:
+            future.result()
+        self._pending.clear()
+
+    def shutdown(self):
+        self.waitForDone()
+        self._pool.shutdown(wait=True)